@@ -1,16 +1,49 @@
 import sys
+from importlib import import_module
 
-from .bot import *
-from .obj import *
-from .image import *
-from .dataclass import *
+from .version import __version__
 from .exceptions import InvalidPythonVersion
 
-# Production
-__version__ = 'p0.0.53'
+# For the IDEs, at runtime the names are imported by __getattr__
+# (typing.TYPE_CHECKING isn't used because importing typing is slow)
+TYPE_CHECKING = False
+if TYPE_CHECKING:
+    from .bot import *
+    from .obj import *
+    from .image import *
+    from .dataclass import *
+    from .executor import *
+    from .db import DB
+    from .archive import *
+    from .analytics import *
 
-# Test
-__version__ = 't0.0.55'
+# Module of each name, it's only imported on the first use of one of its names,
+# so "from amsync import Bot" doesn't import Pillow and "import amsync" imports nothing
+_modules = {
+    'bot':       ['Bot'],
+    'obj':       ['Req', 'User', 'File', 'Chat', 'Community', 'My'],
+    'image':     ['Color', 'MakeImage', 'ProgressBar', 'Render', 'Template', 'Field', 'Grid'],
+    'dataclass': ['Res', 'Reply', 'Msg', 'ChatMsg', 'Embed', 'DataUser', 'DataChat'],
+    'executor':  ['Executor', 'EXECUTOR'],
+    'db':        ['DB'],
+    'archive':   ['Archive'],
+    'analytics': ['Activity']
+}
+_names = {name: module for module, names in _modules.items() for name in names}
+
+__all__ = [*_names, '__version__']
+
+
+def __getattr__(name: str):
+    if name not in _names:
+        raise AttributeError(f"module 'amsync' has no attribute '{name}'")
+
+    value = getattr(import_module(f'.{_names[name]}', __name__), name)
+    globals()[name] = value
+    return value
+
+def __dir__():
+    return [*globals(), *_names]
 
 
 if sys.version_info < (3, 8):
@@ -0,0 +1,331 @@
+from __future__ import annotations
+
+from array import array
+from bisect import bisect_right
+from heapq import nlargest
+from typing import Any, Dict, Iterable, List, Tuple
+from itertools import compress
+from collections import Counter
+
+from peewee import fn
+
+from .db import ArchivedMsg, query
+from .archive import Archive, _where
+from .dataclass import Msg, ChatMsg
+
+# numpy is optional, without it the same results are calculated in python
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+__all__ = ['Activity']
+
+
+class Activity:
+    """
+    Keeps the time, user, chat, media type and length of messages in compact arrays,
+    to calculate rankings and activity statistics of millions of messages
+
+    Users and chats are saved once, each message only keeps their number
+
+    Uses numpy if it's installed
+
+    ```
+    activity = await Activity.from_archive(archive, com=m.com, since=time() - 7 * 86400)
+    activity.top(10)                 # most active users of the week
+    activity.buckets(86400)          # messages per day
+    activity.heatmap(-3 * 3600)      # messages per weekday and hour, in UTC-3
+    ```
+
+    Or updated with each message received
+    ```
+    activity = Activity()
+
+    @bot.on()
+    async def message(m: Msg):
+        activity.add(m)
+    ```
+    """
+
+    def __init__(self):
+        self.times       = array('q')
+        self.uids        = array('l')
+        self.chats       = array('l')
+        self.media_types = array('h')
+        self.lengths     = array('l')
+
+        # Number of each user and chat, and the name of each number
+        self._uid_ids:  Dict[str, int] = {}
+        self._chat_ids: Dict[str, int] = {}
+        self._uids:     List[str]      = []
+        self._chats:    List[str]      = []
+
+    def __len__(self) -> int:
+        return len(self.times)
+
+    def add(self, m: Msg | ChatMsg) -> None:
+        """
+        Adds a message
+        """
+
+        self.append(m.time, m.uid, m.chat, m.media_type, len(m.text or ''))
+
+    def extend(self, msgs: Iterable[Msg | ChatMsg]) -> None:
+        """
+        Adds many messages
+        """
+
+        for m in msgs:
+            self.add(m)
+
+    def append(
+        self,
+        time:       int,
+        uid:        str | None,
+        chat:       str | None,
+        media_type: int | None,
+        length:     int
+    ) -> None:
+        self.times.append(int(time or 0))
+        self.uids.append(_intern(uid or '', self._uid_ids, self._uids))
+        self.chats.append(_intern(chat or '', self._chat_ids, self._chats))
+        self.media_types.append(-1 if media_type is None else media_type)
+        self.lengths.append(length)
+
+    @classmethod
+    async def from_archive(
+        cls,
+        archive: Archive,
+        com:     str | None   = None,
+        chat:    str | None   = None,
+        uid:     str | None   = None,
+        since:   float | None = None,
+        until:   float | None = None
+    ) -> Activity:
+        """
+        Creates an Activity with the messages saved in an Archive, without creating ChatMsg
+        """
+
+        await archive.flush()
+        return await archive._db.read(_from_archive, cls, _where(com, chat, uid, since, until))
+
+    def top(
+        self,
+        n:     int          = 10,
+        by:    str          = 'uid',
+        chat:  str | None   = None,
+        uid:   str | None   = None,
+        since: float | None = None,
+        until: float | None = None
+    ) -> list[Tuple[str, int]]:
+        """
+        Returns the n users (or chats, with by='chat') that sent the most messages and how many they sent
+        """
+
+        codes, names = (self.uids, self._uids) if by == 'uid' else (self.chats, self._chats)
+        counts = self._counts(codes, len(names), self._select(chat, uid, since, until))
+
+        if np:
+            counts = np.asarray(counts)
+            best = np.argpartition(-counts, n)[:n] if n < len(counts) else np.arange(len(counts))
+            # The most messages first, ties by who was seen first, as in nlargest
+            best = best[np.lexsort((best, -counts[best]))]
+            return [(names[i], int(counts[i])) for i in best if counts[i]]
+        return [(names[i], c) for i, c in nlargest(n, enumerate(counts), key=lambda i: i[1]) if c]
+
+    def by_media_type(
+        self,
+        chat:  str | None   = None,
+        uid:   str | None   = None,
+        since: float | None = None,
+        until: float | None = None
+    ) -> Dict[int, int]:
+        """
+        Returns how many messages of each media type were sent
+        """
+
+        selected = self._select(chat, uid, since, until)
+        if np:
+            types = _np(self.media_types)
+            if selected is not None:
+                types = types[selected]
+            values, counts = np.unique(types, return_counts=True)
+            return dict(zip(values.tolist(), counts.tolist()))
+        return dict(sorted(Counter(_compress(self.media_types, selected)).items()))
+
+    def histogram(
+        self,
+        bins:  list[int],
+        chat:  str | None   = None,
+        uid:   str | None   = None,
+        since: float | None = None,
+        until: float | None = None
+    ) -> list[int]:
+        """
+        Returns how many messages have a length between each pair of bins
+
+        ```
+        activity.histogram([0, 10, 50, 200])  # [0-10), [10-50), [50-200), [200-...)
+        ```
+        """
+
+        selected = self._select(chat, uid, since, until)
+        if np:
+            lengths = _np(self.lengths)
+            if selected is not None:
+                lengths = lengths[selected]
+            # Lengths smaller than bins[0] are ignored
+            index = np.searchsorted(np.asarray(bins), lengths, side='right') - 1
+            return np.bincount(index[index >= 0], minlength=len(bins)).tolist()
+
+        counts = [0] * len(bins)
+        for length in _compress(self.lengths, selected):
+            if (i := bisect_right(bins, length) - 1) >= 0:
+                counts[i] += 1
+        return counts
+
+    def buckets(
+        self,
+        size:  int          = 3600,
+        chat:  str | None   = None,
+        uid:   str | None   = None,
+        since: float | None = None,
+        until: float | None = None
+    ) -> Dict[int, int]:
+        """
+        Returns how many messages were sent in each period of size seconds, by the unix time where it starts
+        """
+
+        selected = self._select(chat, uid, since, until)
+        if np:
+            times = _np(self.times)
+            if selected is not None:
+                times = times[selected]
+            values, counts = np.unique(times // size * size, return_counts=True)
+            return dict(zip(values.tolist(), counts.tolist()))
+        return dict(sorted(Counter(t // size * size for t in _compress(self.times, selected)).items()))
+
+    def heatmap(
+        self,
+        utc_offset: int          = 0,
+        chat:       str | None   = None,
+        uid:        str | None   = None,
+        since:      float | None = None,
+        until:      float | None = None
+    ) -> list[list[int]]:
+        """
+        Returns how many messages were sent in each hour of each weekday,
+        heatmap()[0][13] are the messages sent on mondays between 13:00 and 14:00
+
+        #### utc_offset
+        Seconds added to the time, -3 * 3600 for UTC-3
+        """
+
+        selected = self._select(chat, uid, since, until)
+        if np:
+            times = _np(self.times)
+            if selected is not None:
+                times = times[selected]
+            times = times + utc_offset
+            # 01/01/1970 was a thursday
+            cells = (times // 86400 + 3) % 7 * 24 + times // 3600 % 24
+            counts = np.bincount(cells, minlength=7 * 24).tolist()
+        else:
+            counts = [0] * 7 * 24
+            for t in _compress(self.times, selected):
+                t += utc_offset
+                counts[(t // 86400 + 3) % 7 * 24 + t // 3600 % 24] += 1
+        return [counts[i:i + 24] for i in range(0, 7 * 24, 24)]
+
+    def _select(
+        self,
+        chat:  str | None,
+        uid:   str | None,
+        since: float | None,
+        until: float | None
+    ) -> Any:
+        """
+        Returns which messages pass the filters, None if all pass
+
+        A numpy bool array with numpy, otherwise a list of bools
+        """
+
+        conditions = []
+        if chat is not None:
+            conditions.append((self.chats, '==', self._chat_ids.get(chat, -1)))
+        if uid is not None:
+            conditions.append((self.uids, '==', self._uid_ids.get(uid, -1)))
+        if since is not None:
+            conditions.append((self.times, '>=', since))
+        if until is not None:
+            conditions.append((self.times, '<=', until))
+        if not conditions:
+            return None
+
+        if np:
+            selected = np.ones(len(self), bool)
+            for column, op, value in conditions:
+                column = _np(column)
+                selected &= column == value if op == '==' else column >= value if op == '>=' else column <= value
+            return selected
+
+        selected = [True] * len(self)
+        for column, op, value in conditions:
+            if op == '==':
+                selected = [s and c == value for s, c in zip(selected, column)]
+            elif op == '>=':
+                selected = [s and c >= value for s, c in zip(selected, column)]
+            else:
+                selected = [s and c <= value for s, c in zip(selected, column)]
+        return selected
+
+    def _counts(
+        self,
+        codes:    array,
+        size:     int,
+        selected: Any
+    ) -> list[int]:
+        if np:
+            codes = _np(codes)
+            if selected is not None:
+                codes = codes[selected]
+            return np.bincount(codes, minlength=size)
+
+        counts = [0] * size
+        for i in _compress(codes, selected):
+            counts[i] += 1
+        return counts
+
+
+def _intern(
+    name:  str,
+    ids:   Dict[str, int],
+    names: List[str]
+) -> int:
+    if (i := ids.get(name)) is None:
+        i = ids[name] = len(names)
+        names.append(name)
+    return i
+
+def _np(column: array):
+    # Without copying the array
+    return np.frombuffer(column, column.typecode)
+
+def _compress(column: array, selected: list[bool] | None) -> Iterable:
+    return column if selected is None else compress(column, selected)
+
+def _from_archive(cls: type[Activity], where: list) -> Activity:
+    activity = cls()
+    with query():
+        rows = (
+            ArchivedMsg
+            .select(ArchivedMsg.time, ArchivedMsg.uid, ArchivedMsg.chat, ArchivedMsg.media_type, fn.LENGTH(ArchivedMsg.text).coerce(False))
+            .where(*where)
+            .order_by(ArchivedMsg.time)
+            .tuples()
+            .iterator()
+        )
+        for time, uid, chat, media_type, length in rows:
+            activity.append(time, uid, chat, media_type, length or 0)
+    return activity
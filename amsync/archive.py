@@ -0,0 +1,438 @@
+from __future__ import annotations
+
+from time import time
+from typing import Any, Dict, List, Tuple
+
+from ujson import dumps, loads
+from peewee import SQL, fn, chunked
+
+from . import obj
+from .db import AsyncDB, ArchivedMsg, ArchivedMsgIndex, SyncState, _Flusher, query
+from .obj import MESSAGE, _req
+from .dataclass import Msg, ChatMsg, Reply
+from .utils import get_value
+
+__all__ = ['Archive']
+
+
+class Archive(_Flusher):
+    """
+    Saves the messages received by the bot, so the history of a chat
+    is read from the disk instead of paging Chat.messages
+
+    ```
+    archive = Archive()
+    bot = Bot(archive=archive)
+
+    @bot.add()
+    async def last(m: Msg):
+        msgs = await archive.history(chat=m.chat, uid=m.uid, limit=50)
+
+    @bot.add()
+    async def top(m: Msg):
+        ranking = await archive.top(chat=m.chat, since=time() - 86400)
+    ```
+
+    #### batch_size
+    Messages are saved together, in one transaction, when this many are waiting
+
+    #### flush_every
+    Maximum seconds a message waits to be saved
+    """
+
+    def __init__(
+        self,
+        batch_size:  int   = 500,
+        flush_every: float = 1.0
+    ):
+        super().__init__(flush_every)
+        self.batch_size = batch_size
+
+        self._db:      AsyncDB               = AsyncDB()
+        self._pending: List[Dict[str, Any]]  = []
+
+    def add(self, m: Msg | ChatMsg) -> None:
+        """
+        Saves m on the next flush, messages that are already saved are ignored
+        """
+
+        if not m.id:
+            return
+
+        self._pending.append(_to_row(m))
+        if len(self._pending) >= self.batch_size:
+            self._flush_now()
+        else:
+            self._schedule()
+
+    async def flush(self) -> None:
+        """
+        Saves the waiting messages now
+        """
+
+        if self._flush:
+            self._flush.cancel()
+            self._flush = None
+        if not self._pending:
+            return
+
+        rows, self._pending = self._pending, []
+        try:
+            await self._db.write(_save_msgs, rows)
+        except BaseException:
+            self._pending = rows + self._pending
+            self._retry()
+            raise
+        self._retries = 0
+
+    async def history(
+        self,
+        com:   str | None   = None,
+        chat:  str | None   = None,
+        uid:   str | None   = None,
+        since: float | None = None,
+        until: float | None = None,
+        limit: int | None   = 50
+    ) -> list[ChatMsg]:
+        """
+        Returns the saved messages, from the most recent to the oldest
+
+        #### since, until
+        Unix time of the oldest and newest message
+        """
+
+        await self.flush()
+        return await self._db.read(_history, _where(com, chat, uid, since, until), limit)
+
+    async def count(
+        self,
+        com:   str | None   = None,
+        chat:  str | None   = None,
+        uid:   str | None   = None,
+        since: float | None = None,
+        until: float | None = None
+    ) -> int:
+        """
+        Returns the amount of saved messages
+        """
+
+        await self.flush()
+        return await self._db.read(_count, _where(com, chat, uid, since, until))
+
+    async def top(
+        self,
+        com:   str | None   = None,
+        chat:  str | None   = None,
+        since: float | None = None,
+        until: float | None = None,
+        limit: int          = 10
+    ) -> list[Tuple[str, int]]:
+        """
+        Returns the users that sent the most messages and how many they sent
+        """
+
+        await self.flush()
+        return await self._db.read(_top, _where(com, chat, None, since, until), limit)
+
+    async def search(
+        self,
+        text:   str,
+        com:    str | None   = None,
+        chat:   str | None   = None,
+        uid:    str | None   = None,
+        since:  float | None = None,
+        until:  float | None = None,
+        limit:  int | None   = 50,
+        phrase: bool         = False,
+        prefix: bool         = False
+    ) -> list[ChatMsg]:
+        """
+        Returns the saved messages that have all the words of text, from the most recent to the oldest
+
+        Case and accents are ignored
+
+        ```
+        await archive.search('discord.gg', chat=m.chat)
+        await archive.search('free nitro', phrase=True)
+        await archive.search('spam', prefix=True) # spam, spammer, spamming, ...
+        ```
+
+        #### phrase
+        The words must be together and in the same order
+
+        #### prefix
+        The last word can be the beginning of a word
+        """
+
+        await self.flush()
+        if not (match := _match(text, phrase, prefix)):
+            return []
+        return await self._db.read(_search, match, _where(com, chat, uid, since, until), limit)
+
+    async def sync(
+        self,
+        com:       str | None = None,
+        chat:      str | None = None,
+        backfill:  bool       = True,
+        max_pages: int | None = None
+    ) -> int:
+        """
+        Downloads the messages of a chat that aren't saved yet and returns how many were downloaded
+
+        The first sync walks the history from the newest message to the oldest,
+        the next ones only download the messages sent since the last sync,
+        and a backfill that was interrupted continues from the page where it stopped
+
+        ```
+        await archive.sync(chat=m.chat, max_pages=10)
+        ```
+
+        #### backfill
+        If False, doesn't walk to the oldest messages, a later sync with backfill=True continues it
+
+        #### max_pages
+        Maximum pages of 100 messages downloaded by this call
+        """
+
+        com = com or obj.actual_com
+        chat = chat or obj.actual_chat
+        state = await self._db.read(_load_state, com, chat)
+        first_sync = state['newest_id'] is None
+        downloaded = 0
+        pages = 0
+
+        def can_download() -> bool:
+            return max_pages is None or pages < max_pages
+
+        # New messages, until one saved by the last sync is found
+        token = None
+        newest = None
+        while can_download():
+            msgs, next_token = await _page(com, chat, token)
+            pages += 1
+            newest = newest or (msgs[0] if msgs else None)
+
+            new = msgs
+            for i, m in enumerate(msgs):
+                if not first_sync and (m.id == state['newest_id'] or (m.time or 0) < (state['newest_time'] or 0)):
+                    new = msgs[:i]
+                    break
+            downloaded += len(new)
+
+            reached = len(new) < len(msgs) or not next_token
+            if first_sync or reached:
+                # The gap is only marked as synced after all of it is saved
+                if newest:
+                    state['newest_id'] = newest.id
+                    state['newest_time'] = newest.time
+                if first_sync:
+                    # The walk of the first sync is also the backfill
+                    state['oldest_token'] = next_token
+                    state['done'] = not next_token
+
+            await self._db.write(_save_page, _to_rows(new, com, chat), com, chat, dict(state))
+            if reached or first_sync and not backfill:
+                break
+            token = next_token
+
+        # Older messages, from the page where the last backfill stopped
+        while backfill and not state['done'] and state['oldest_token'] and can_download():
+            msgs, next_token = await _page(com, chat, state['oldest_token'])
+            pages += 1
+            downloaded += len(msgs)
+
+            state['oldest_token'] = next_token
+            state['done'] = not next_token
+            await self._db.write(_save_page, _to_rows(msgs, com, chat), com, chat, dict(state))
+
+        return downloaded
+
+
+def _to_row(m: Msg | ChatMsg) -> Dict[str, Any]:
+    return {
+        'id':         m.id,
+        'com':        m.com or '',
+        'chat':       m.chat or '',
+        'uid':        m.uid,
+        'nickname':   m.nickname,
+        'icon':       m.icon,
+        'level':      m.level,
+        'type':       m.type,
+        'media_type': m.media_type,
+        'text':       m.text,
+        'file_link':  m.file_link,
+        'ref_id':     m.ref_id,
+        'extensions': dumps(m.extensions) if m.extensions else None,
+        # Messages of the websocket without createdTime were sent now
+        'time':       m.time or int(time())
+    }
+
+def _to_rows(
+    msgs: list[ChatMsg],
+    com:  str,
+    chat: str
+) -> List[Dict[str, Any]]:
+    # Messages of Chat.messages may not have the community and the chat
+    return [{**_to_row(m), 'com': com, 'chat': chat} for m in msgs if m.id]
+
+def _to_msg(row: ArchivedMsg) -> ChatMsg:
+    ext = loads(row.extensions) if row.extensions else {}
+
+    r = None
+    if 'replyMessage' in ext:
+        r = Reply(
+            icon     = get_value(ext, 'replyMessage', 'author', 'icon'),
+            id       = get_value(ext, 'replyMessageId'),
+            nickname = get_value(ext, 'replyMessage', 'author', 'nickname'),
+            uid      = get_value(ext, 'replyMessage', 'author', 'uid')
+        )
+
+    return ChatMsg(
+        chat             = row.chat or None,
+        com              = row.com or None,
+        extensions       = ext,
+        file_link        = row.file_link,
+        icon             = row.icon,
+        id               = row.id,
+        level            = row.level,
+        media_type       = row.media_type,
+        mentioned_users  = [u['uid'] for u in ext.get('mentionedArray') or []],
+        nickname         = row.nickname,
+        ref_id           = row.ref_id,
+        reply            = r,
+        text             = row.text,
+        time             = row.time,
+        type             = row.type,
+        uid              = row.uid
+    )
+
+def _where(
+    com:   str | None,
+    chat:  str | None,
+    uid:   str | None,
+    since: float | None,
+    until: float | None
+) -> list:
+    where = []
+    if com:
+        where.append(ArchivedMsg.com == com)
+    if chat:
+        where.append(ArchivedMsg.chat == chat)
+    if uid:
+        where.append(ArchivedMsg.uid == uid)
+    if since is not None:
+        where.append(ArchivedMsg.time >= since)
+    if until is not None:
+        where.append(ArchivedMsg.time <= until)
+    return where or [SQL('1')]
+
+def _save_msgs(rows: List[Dict[str, Any]]) -> None:
+    # SQLite has a limit of variables per query
+    for batch in chunked(rows, 50):
+        ArchivedMsg.insert_many(batch).on_conflict_ignore().execute()
+
+async def _page(
+    com:   str,
+    chat:  str,
+    token: str | None
+) -> Tuple[list[ChatMsg], str | None]:
+    """
+    Returns a page of Chat.messages and the token of the next page
+    """
+
+    url = f'x{com}/s/chat/thread/{chat}/message?v=2&pagingType=t&size=100'
+    if token:
+        url += f'&pageToken={token}'
+
+    res = await _req('get', url)
+    return (
+        [MESSAGE.from_chat(i) for i in res.json['messageList']],
+        get_value(res.json, 'paging', 'nextPageToken')
+    )
+
+def _load_state(com: str, chat: str) -> Dict[str, Any]:
+    with query():
+        state = SyncState.get_or_none(SyncState.com == com, SyncState.chat == chat)
+
+    if not state:
+        return {'newest_id': None, 'newest_time': None, 'oldest_token': None, 'done': False}
+    return {
+        'newest_id':    state.newest_id,
+        'newest_time':  state.newest_time,
+        'oldest_token': state.oldest_token,
+        'done':         state.done
+    }
+
+def _save_page(
+    rows:  List[Dict[str, Any]],
+    com:   str,
+    chat:  str,
+    state: Dict[str, Any]
+) -> None:
+    """
+    Saves the messages of a page with the checkpoint of the sync, in the same transaction
+    """
+
+    _save_msgs(rows)
+    SyncState.insert(com=com, chat=chat, **state).on_conflict_replace().execute()
+
+def _history(where: list, limit: int | None) -> list[ChatMsg]:
+    with query():
+        rows = (
+            ArchivedMsg
+            .select()
+            .where(*where)
+            # rowid keeps the order of messages sent in the same second
+            .order_by(ArchivedMsg.time.desc(), SQL('rowid').desc())
+            .limit(limit)
+        )
+        return [_to_msg(i) for i in rows]
+
+def _match(
+    text:   str,
+    phrase: bool,
+    prefix: bool
+) -> str:
+    """
+    Converts text to a FTS5 query, quoting the words so symbols of links aren't read as operators
+    """
+
+    words = ['"' + i.replace('"', '""') + '"' for i in ([text.strip()] if phrase else text.split()) if i]
+    if words and prefix:
+        words[-1] += '*'
+    return ' '.join(words)
+
+def _search(
+    match: str,
+    where: list,
+    limit: int | None
+) -> list[ChatMsg]:
+    with query():
+        # The index is searched once, then the messages are read by rowid
+        found = ArchivedMsgIndex.select(ArchivedMsgIndex.rowid).where(ArchivedMsgIndex.match(match))
+        rows = (
+            ArchivedMsg
+            .select()
+            .where(SQL('rowid').in_(found), *where)
+            .order_by(ArchivedMsg.time.desc())
+            .limit(limit)
+        )
+        return [_to_msg(i) for i in rows]
+
+def _count(where: list) -> int:
+    with query():
+        return ArchivedMsg.select().where(*where).count()
+
+def _top(where: list, limit: int) -> list[Tuple[str, int]]:
+    with query():
+        count = fn.COUNT(ArchivedMsg.id)
+        rows = (
+            ArchivedMsg
+            .select(ArchivedMsg.uid, count)
+            .where(ArchivedMsg.uid.is_null(False), *where)
+            .group_by(ArchivedMsg.uid)
+            .order_by(count.desc())
+            .limit(limit)
+            .tuples()
+        )
+        return list(rows)
@@ -1,8 +1,8 @@
 from __future__ import annotations
 
 import sys
-from re import search
 from os import environ, execl
+from time import perf_counter
 
 from asyncio import (
     gather,
@@ -14,8 +14,8 @@ from asyncio import (
     TimeoutError,
     Future
 )
-from dotenv import load_dotenv
 from typing import (
+    TYPE_CHECKING,
     Any,
     Callable,
     Awaitable,
@@ -26,14 +26,15 @@ from typing import (
 )
 from pathlib import Path
 from threading import Thread
+from multiprocessing import current_process, parent_process
 from subprocess import run
 
 from colorama import Fore, Style, init
 
 from .ws import Ws
-from .db import _DB
+from .version import version
 from .obj import Message, Req, Community, _req, My
-from .utils import Slots, clear, one_or_list, to_list
+from .utils import Slots, clear, lazy_import, one_or_list, to_list
 from .dataclass import Msg, Embed, Res
 from .exceptions import (
     AccountNotFoundInDotenv,
@@ -45,9 +46,13 @@ from .exceptions import (
     InvalidRole
 )
 
+if TYPE_CHECKING:
+    from .db import AsyncDB
+    from .archive import Archive
+
 __all__ = ['Bot']
-with open(f'{Path(__file__).parent}/__init__.py') as f:
-    version = search(r'p[0-9]+.[0-9]+.[0-9]+', f.read()).group()[1:]
+
+dotenv = lazy_import('dotenv')
 
 Coro_return_ws_msg = Callable[[], Coroutine[Msg, None, None]]
 Coro_return_Any    = Callable[[], Coroutine[Any, None, None]]
@@ -66,7 +71,9 @@ class Bot(Slots):
         password:     str | None           = None,
         prefix:       str                  = '/',
         only_chats:   dict[str, list[str]] = {},
-        ignore_chats: dict[str, list[str]] = {}
+        ignore_chats: dict[str, list[str]] = {},
+        archive:      Archive | None       = None,
+        update:       Literal['ask', 'notify', 'off'] = 'notify'
     ):
         """
         #### only_chats
@@ -90,12 +97,24 @@ class Bot(Slots):
 
         The bot had listened to the 00000.... 11111.... chats from the 1111111 community,
         and had listened to all the chats in the community 2222222.
+
+        #### archive
+
+        Archive where every message received is saved, see Archive
+
+        #### update
+
+        'ask' checks for a new version before starting and asks if it should update
+
+        'notify' checks in the background and only shows the new version, without delaying the start
+
+        'off' never checks
         """
 
         init()
         # load_dotenv is not identifying the .env on project folder,
         # so I use Path to get the absolute .env path
-        load_dotenv(Path('.env').absolute())
+        dotenv.load_dotenv(Path('.env').absolute())
         try:
             self._email    = email    or environ['EMAIL']
             self._password = password or environ['PASSWORD']
@@ -110,13 +129,15 @@ class Bot(Slots):
         self.id:    str                             = 'ws.run'
         self.sid:   str                             = 'ws.run'
         self.staff: Dict[str, Dict[str, list[str]]] = {}
-        self._db:   _DB                             = _DB()
+        self._db:   AsyncDB | None                  = None
         self._msg:  Message                         = Message()
         self._loop: AbstractEventLoop               = new_event_loop()
 
         self.prefix       = prefix
         self.only_chats   = only_chats
         self.ignore_chats = ignore_chats
+        self.archive      = archive
+        self.update       = update
 
         self.commands: dict[str, dict[str, list[str], Coro_return_None, str]] = {}
         self.events:   dict[str, list[Coro_return_None]] = {
@@ -198,8 +219,13 @@ class Bot(Slots):
         If the program runs on heroku, the program will not check for updates
         """
 
-        def try_update() -> NoReturn | None:
-            if self._db.deps_need_update():
+        if not self._db:
+            # peewee is only imported when it's used
+            from .db import AsyncDB
+            self._db = AsyncDB()
+
+        async def try_update() -> NoReturn | None:
+            if await self._db.deps_need_update():
                 cmd = run('pip install -U amsync', capture_output=True, text=True)
             else:
                 cmd = run('pip install -U amsync --no-deps', capture_output=True, text=True)
@@ -212,20 +238,25 @@ class Bot(Slots):
 
         if (
             'DYNO' not in environ   # not in heroku
-            and self._db.lib_need_update()
+            and await self._db.lib_need_update()
         ):      
             new = (await Req.new('get', 'https://pypi.org/pypi/Amsync/json')).json['info']['version']
             if new != version:
                 print(f'There is a new version: {Fore.CYAN}{new}{Fore.WHITE}')
                 print(f'Actual version: {Style.BRIGHT}{version}{Style.NORMAL}\n')
+                if self.update == 'notify':
+                    # input() would block the bot, which is already running
+                    print(f'Update it with: {Fore.CYAN}pip install -U amsync{Fore.WHITE}\n')
+                    return
+
                 print(f'Do you want to update it? (Y/n) ', end='')
                 if input().lower() == 'y':
                     clear()
                     print('Updating...')
-                    try_update()
+                    await try_update()
                     clear()
                     print('Restarting...\n')
-                    Path('db.db').unlink(missing_ok=True)
+                    # db.db is kept, it has the DB values and the Archive, the tables are migrated on the next start
                     execl(sys.executable, Path(__file__).absolute(), *sys.argv)
                 clear()
 
@@ -234,13 +265,28 @@ class Bot(Slots):
         Start the bot
         """
 
-        self._loop.run_until_complete(self.check_update())
+        # The processes of EXECUTOR import the script of the bot again,
+        # and bot.run() (at the top of the script or inside a function) must not start another bot there.
+        # While the script is imported parent_process() is still None, but the process already has its name
+        if parent_process() is not None or current_process().name != 'MainProcess':
+            return
+
+        started = perf_counter()
+        if self.update == 'ask':
+            self._loop.run_until_complete(self.check_update())
+        elif self.update == 'notify':
+            # A failed check (no internet, pypi offline) must not show errors in a running bot
+            task = self._loop.create_task(self.check_update())
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+
         self._ws = Ws(
+            started      = started,
             loop         = self._loop,
             email        = self._email,
             password     = self._password,
             only_chats   = self.only_chats,
-            ignore_chats = self.ignore_chats
+            ignore_chats = self.ignore_chats,
+            archive      = self.archive
         )
 
         Thread(target=self._loop.run_forever).start()
@@ -259,6 +305,27 @@ class Bot(Slots):
             fut.result()
         except:
             raise fut.exception()
+        finally:
+            run_coroutine_threadsafe(self.close(), self._loop).result()
+
+    async def close(self) -> None:
+        """
+        Saves the changes of every DB and the messages of the Archive that are still waiting
+
+        Called when Bot.run stops
+        """
+
+        # Imported here so peewee isn't imported when the bot starts
+        from .db import close_all
+        await close_all()
+
+    @property
+    def ready_in(self) -> float | None:
+        """
+        Seconds from Bot.run to the first ready event, None before it
+        """
+
+        return self._ws.ready_in if hasattr(self, '_ws') else None
 
     async def status(
         self,
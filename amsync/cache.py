@@ -0,0 +1,359 @@
+from __future__ import annotations
+
+from os import replace, utime
+from time import time
+from uuid import uuid4
+from typing import Dict, List, Tuple
+from asyncio import Task, shield, get_running_loop
+from hashlib import sha1
+from pathlib import Path
+from collections import OrderedDict
+from contextlib import suppress
+
+from ujson import dump, load
+
+from .utils import lazy_import
+from .executor import EXECUTOR
+from .exceptions import FileTooLarge
+
+__all__ = ['DownloadCache']
+
+_1_MB = 1024 * 1024
+
+# Metadata of files kept in memory
+_MAX_META = 4096
+
+aiohttp = lazy_import('aiohttp')
+
+
+class DownloadCache:
+    """
+    Caches the files downloaded by File.get, in memory and in disk
+
+    A cached file is served locally for fresh_for seconds (or for the max-age sent by the server),
+    after that it is revalidated with If-None-Match / If-Modified-Since,
+    so an unchanged file is never downloaded again
+
+    The files are read and written in the threads of EXECUTOR, never in the event loop
+
+    #### path
+    Folder where the files are saved, it's only created on the first download
+
+    #### max_size
+    Files bigger than this raise FileTooLarge, without being downloaded entirely
+
+    #### memory_size
+    Maximum bytes kept in memory, the least used files are removed first
+
+    #### disk_size
+    Maximum bytes kept in path, the least used files are removed first
+
+    #### spool_size
+    Files bigger than this are written straight to disk while downloading,
+    instead of being kept in memory
+
+    #### timeout
+    Maximum seconds of a download
+    """
+
+    def __init__(
+        self,
+        path:        str | Path = '.amsync/downloads',
+        max_size:    int        = 50 * _1_MB,
+        memory_size: int        = 32 * _1_MB,
+        disk_size:   int        = 512 * _1_MB,
+        spool_size:  int        = _1_MB,
+        fresh_for:   int        = 300,
+        timeout:     int        = 30
+    ):
+        self.path        = Path(path)
+        self.max_size    = max_size
+        self.memory_size = memory_size
+        self.disk_size   = disk_size
+        self.spool_size  = spool_size
+        self.fresh_for   = fresh_for
+        self.timeout     = timeout
+
+        self._memory:      OrderedDict[str, bytes] = OrderedDict()
+        self._memory_used: int                     = 0
+        self._meta:        OrderedDict[str, dict]  = OrderedDict()
+        self._downloading: Dict[str, Task]         = {}
+
+        # Size of each file in path, from the least to the most used, read from the folder on the first get
+        self._disk:      OrderedDict[str, int] | None = None
+        self._disk_used: int                          = 0
+        self._scan:      Task | None                  = None
+
+    async def get(self, url: str) -> bytes:
+        """
+        Returns the bytes of url, downloading it only if the cached file is missing or has changed
+
+        Concurrent calls with the same url share a single download
+        """
+
+        if not (task := self._downloading.get(url)):
+            task = get_running_loop().create_task(self._get(url))
+            self._downloading[url] = task
+            task.add_done_callback(lambda _: self._downloading.pop(url, None))
+
+        # One caller being cancelled must not cancel the download of the others
+        return await shield(task)
+
+    def clear(self) -> None:
+        """
+        Removes all cached files, from memory and disk
+        """
+
+        self._memory.clear()
+        self._memory_used = 0
+        self._meta.clear()
+        self._disk = OrderedDict()
+        self._disk_used = 0
+        if self.path.exists():
+            for file in self.path.iterdir():
+                file.unlink(missing_ok=True)
+
+    async def _get(self, url: str) -> bytes:
+        key = sha1(url.encode()).hexdigest()
+        if self._disk is None:
+            if not self._scan:
+                self._scan = get_running_loop().create_task(EXECUTOR.thread(self._scan_disk))
+            disk = await shield(self._scan)
+            if self._disk is None:
+                self._disk = disk
+                self._disk_used = sum(disk.values())
+
+        meta = await self._load_meta(key)
+        cached = await self._read(key) if meta else None
+
+        if cached is not None and time() < meta['expires_in']:
+            return cached
+
+        # Without the body, a 304 would have nothing to return
+        req_headers = {}
+        if cached is not None:
+            if meta.get('etag'):
+                req_headers['If-None-Match'] = meta['etag']
+            if meta.get('last_modified'):
+                req_headers['If-Modified-Since'] = meta['last_modified']
+
+        async with aiohttp.request(
+            'get',
+            url,
+            headers = req_headers,
+            timeout = aiohttp.ClientTimeout(total=self.timeout)
+        ) as res:
+            if res.status == 304 and cached is not None:
+                meta['expires_in'] = self._expires_in(res.headers)
+                await self._save_meta(key, meta)
+                return cached
+
+            res.raise_for_status()
+            if (res.content_length or 0) > self.max_size:
+                raise FileTooLarge(f'{url} has {res.content_length} bytes, the limit is {self.max_size}')
+
+            b, spooled = await self._download(url, key, res)
+            meta = {
+                'url':           url,
+                'etag':          res.headers.get('ETag'),
+                'last_modified': res.headers.get('Last-Modified'),
+                'expires_in':    self._expires_in(res.headers),
+                'no_store':      'no-store' in res.headers.get('Cache-Control', '')
+            }
+
+        if meta['no_store']:
+            await self._forget([key])
+            return b
+
+        if not spooled:
+            await EXECUTOR.thread(self._write, key, b)
+        await self._save_meta(key, meta)
+        self._remember(key, b)
+        await self._stored(key, len(b))
+        return b
+
+    async def _download(self, url, key, res) -> Tuple[bytes, bool]:
+        """
+        Reads the body of res, moving it to disk once it passes spool_size
+
+        Returns the body and whether it was already written to the cache folder
+        """
+
+        chunks = []
+        size = 0
+        spool = None
+        tmp = self.path / f'{key}.{uuid4().hex}.tmp'
+
+        try:
+            async for chunk in res.content.iter_chunked(64 * 1024):
+                size += len(chunk)
+                if size > self.max_size:
+                    raise FileTooLarge(f'{url} has more than {self.max_size} bytes')
+
+                if spool:
+                    await EXECUTOR.thread(spool.write, chunk)
+                    continue
+
+                chunks.append(chunk)
+                if size > self.spool_size:
+                    spool = await EXECUTOR.thread(self._open_spool, tmp)
+                    await EXECUTOR.thread(spool.write, b''.join(chunks))
+                    chunks.clear()
+
+            if not spool:
+                return b''.join(chunks), False
+
+            spool.close()
+            return await EXECUTOR.thread(self._finish_spool, tmp, key), True
+        finally:
+            if spool:
+                spool.close()
+                tmp.unlink(missing_ok=True)
+
+    def _expires_in(self, headers) -> float:
+        fresh_for = self.fresh_for
+        for directive in headers.get('Cache-Control', '').split(','):
+            name, _, value = directive.strip().partition('=')
+            if name == 'max-age' and value.isdigit():
+                fresh_for = int(value)
+            elif name in ('no-cache', 'no-store'):
+                fresh_for = 0
+        return time() + fresh_for
+
+    def _file(self, key: str) -> Path:
+        return self.path / key
+
+    async def _read(self, key: str) -> bytes | None:
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            self._used(key)
+            return self._memory[key]
+
+        if (b := await EXECUTOR.thread(self._read_file, key)) is not None:
+            self._remember(key, b)
+            self._used(key)
+        elif key in self._disk:
+            # Removed from the folder by someone else
+            self._disk_used -= self._disk.pop(key)
+        return b
+
+    def _read_file(self, key: str) -> bytes | None:
+        with suppress(FileNotFoundError):
+            b = self._file(key).read_bytes()
+            # The modification time is the last use, so the order survives a restart
+            utime(self._file(key))
+            return b
+
+    def _write(self, key: str, b: bytes) -> None:
+        self.path.mkdir(parents=True, exist_ok=True)
+        tmp = self.path / f'{key}.{uuid4().hex}.tmp'
+        tmp.write_bytes(b)
+        replace(tmp, self._file(key))
+
+    def _open_spool(self, tmp: Path):
+        self.path.mkdir(parents=True, exist_ok=True)
+        return open(tmp, 'wb')
+
+    def _finish_spool(self, tmp: Path, key: str) -> bytes:
+        replace(tmp, self._file(key))
+        return self._file(key).read_bytes()
+
+    def _remember(self, key: str, b: bytes) -> None:
+        """
+        Keeps b in memory, removing the least used files if memory_size was exceeded
+        """
+
+        if len(b) > self.spool_size:
+            return
+
+        if key in self._memory:
+            self._memory_used -= len(self._memory.pop(key))
+        self._memory[key] = b
+        self._memory_used += len(b)
+
+        while self._memory_used > self.memory_size:
+            _, old = self._memory.popitem(last=False)
+            self._memory_used -= len(old)
+
+    def _scan_disk(self) -> OrderedDict[str, int]:
+        """
+        Returns the size of the files already in path, from the least to the most used
+        """
+
+        files = []
+        if self.path.exists():
+            for file in self.path.iterdir():
+                if '.' not in file.name:
+                    with suppress(FileNotFoundError):
+                        stat = file.stat()
+                        files.append((stat.st_mtime, file.name, stat.st_size))
+
+        return OrderedDict((name, size) for _, name, size in sorted(files))
+
+    def _used(self, key: str) -> None:
+        if key in self._disk:
+            self._disk.move_to_end(key)
+
+    async def _stored(self, key: str, size: int) -> None:
+        """
+        Counts the file of key in disk_size, removing the least used files if it was exceeded
+        """
+
+        self._disk_used += size - self._disk.pop(key, 0)
+        self._disk[key] = size
+
+        old = []
+        while self._disk_used > self.disk_size and len(self._disk) > 1:
+            k, size = self._disk.popitem(last=False)
+            self._disk_used -= size
+            old.append(k)
+        if old:
+            await self._forget(old)
+
+    async def _forget(self, keys: List[str]) -> None:
+        """
+        Removes the cached files of keys, from memory and disk
+        """
+
+        for key in keys:
+            if key in self._memory:
+                self._memory_used -= len(self._memory.pop(key))
+            if key in self._disk:
+                self._disk_used -= self._disk.pop(key)
+            self._meta.pop(key, None)
+        await EXECUTOR.thread(self._unlink, keys)
+
+    def _unlink(self, keys: List[str]) -> None:
+        for key in keys:
+            self._file(key).unlink(missing_ok=True)
+            (self.path / f'{key}.json').unlink(missing_ok=True)
+
+    async def _load_meta(self, key: str) -> dict | None:
+        if key not in self._meta:
+            if (meta := await EXECUTOR.thread(self._read_meta, key)) is None:
+                return None
+            self._keep_meta(key, meta)
+
+        self._meta.move_to_end(key)
+        return self._meta[key]
+
+    def _read_meta(self, key: str) -> dict | None:
+        with suppress(FileNotFoundError, ValueError):
+            with open(self.path / f'{key}.json') as f:
+                return load(f)
+
+    async def _save_meta(self, key: str, meta: dict) -> None:
+        self._keep_meta(key, meta)
+        await EXECUTOR.thread(self._write_meta, key, meta)
+
+    def _write_meta(self, key: str, meta: dict) -> None:
+        self.path.mkdir(parents=True, exist_ok=True)
+        with open(self.path / f'{key}.json', 'w') as f:
+            dump(meta, f, escape_forward_slashes=False)
+
+    def _keep_meta(self, key: str, meta: dict) -> None:
+        # Only the most used are kept in memory, the others are read again from their .json
+        self._meta[key] = meta
+        self._meta.move_to_end(key)
+        while len(self._meta) > _MAX_META:
+            self._meta.popitem(last=False)
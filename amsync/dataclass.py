@@ -5,7 +5,7 @@ from dataclasses import dataclass
 
 from ujson import loads
 
-from .utils import Slots, get_value
+from .utils import Slots, get_value, to_timestamp
 
 __all__ = [
     'Res',
@@ -73,6 +73,7 @@ class Msg(Slots):
     ref_id:          int | None
     reply:           Reply
     text:            str | None
+    time:            int | None
     type:            str | None
     uid:             str | None
 
@@ -104,6 +105,7 @@ class Msg(Slots):
             ref_id           = get_value(cm, 'clientRefId'),
             reply            = r,
             text             = get_value(cm, 'content'),
+            time             = get_value(cm, 'createdTime', convert=to_timestamp),
             type             = get_value(cm, 'type'),
             uid              = get_value(cm, 'uid')
         )
@@ -127,6 +129,7 @@ class ChatMsg(Slots):
     ref_id:          int | None
     reply:           Reply | None
     text:            str | None
+    time:            int | None
     type:            str | None
     uid:             str | None
 
@@ -157,6 +160,7 @@ class ChatMsg(Slots):
             ref_id           = get_value(j, 'clientRefId'),
             reply            = r,
             text             = get_value(j, 'content'),
+            time             = get_value(j, 'createdTime', convert=to_timestamp),
             type             = get_value(j, 'type'),
             uid              = get_value(j, 'uid')
         )
@@ -1,21 +1,56 @@
+from __future__ import annotations
+
+import sys
 from time import time
+from typing import Any, Awaitable, Callable, Dict, Set, Tuple
+from weakref import WeakSet
+from asyncio import Queue, Task, TimerHandle, AbstractEventLoop, CancelledError, gather, get_running_loop
+from functools import partial
 from contextlib import contextmanager
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from ujson import dumps, loads
 
 from peewee import (
     SqliteDatabase,
+    BooleanField,
     CharField,
     IntegerField,
-    Model,
-    OperationalError
+    TextField,
+    Model
 )
+from playhouse.sqlite_ext import FTS5Model, SearchField
+
+from .executor import EXECUTOR
+
+__all__ = ['DB']
 
 
-db = SqliteDatabase('db.db')
+# Write-ahead log lets reads happen while writing, and with synchronous=normal
+# a commit doesn't wait for the disk, only checkpoints do
+db = SqliteDatabase(
+    'db.db',
+    pragmas={
+        'journal_mode': 'wal',
+        'synchronous':  'normal',
+        'cache_size':   -8 * 1024,        # 8MB
+        'mmap_size':    64 * 1024 * 1024,
+        'temp_store':   'memory'
+    },
+    cached_statements=256
+)
+# Increase when a table or index is added, so _DB creates it once
+SCHEMA_VERSION = 6
 _1_DAY = 86400
 _3_DAYS = 259200
 
+# Limits of the upload cache, see _DB.get_media
+media_max_age     = 7 * _1_DAY
+media_max_entries = 5000
+
 class Account(Model):
-    email = CharField()
+    email = CharField(index=True)
     sid = CharField()
     change_in = IntegerField()
 
@@ -29,28 +64,131 @@ class Update(Model):
     class Meta:
         database = db
 
+class Media(Model):
+    key = CharField()
+    target = CharField()
+    link = CharField()
+    change_in = IntegerField()
+
+    class Meta:
+        database = db
+        indexes = (
+            (('key', 'target'), True),
+        )
+
+class Data(Model):
+    com = CharField()
+    chat = CharField()
+    uid = CharField()
+    key = CharField()
+    value = TextField()
+
+    class Meta:
+        database = db
+        indexes = (
+            (('com', 'chat', 'uid', 'key'), True),
+            (('key', 'com', 'chat'), False),
+        )
+
+class ArchivedMsg(Model):
+    id = CharField(primary_key=True)
+    com = CharField()
+    chat = CharField()
+    uid = CharField(null=True)
+    nickname = CharField(null=True)
+    icon = CharField(null=True)
+    level = IntegerField(null=True)
+    type = IntegerField(null=True)
+    media_type = IntegerField(null=True)
+    text = TextField(null=True)
+    file_link = CharField(null=True)
+    ref_id = IntegerField(null=True)
+    extensions = TextField(null=True)
+    time = IntegerField()
+
+    class Meta:
+        database = db
+        indexes = (
+            (('com', 'chat', 'time'), False),
+            (('uid', 'time'), False),
+        )
+
+# Full-text index of ArchivedMsg.text, kept up to date by the triggers of _SEARCH_TRIGGERS
+class ArchivedMsgIndex(FTS5Model):
+    text = SearchField()
+
+    class Meta:
+        database = db
+        options = {
+            'content':  ArchivedMsg,
+            'tokenize': 'unicode61 remove_diacritics 2'
+        }
+
+_SEARCH_TRIGGERS = [
+    '''CREATE TRIGGER IF NOT EXISTS archivedmsg_ai AFTER INSERT ON archivedmsg BEGIN
+        INSERT INTO archivedmsgindex(rowid, text) VALUES (new.rowid, new.text);
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS archivedmsg_ad AFTER DELETE ON archivedmsg BEGIN
+        INSERT INTO archivedmsgindex(archivedmsgindex, rowid, text) VALUES ('delete', old.rowid, old.text);
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS archivedmsg_au AFTER UPDATE ON archivedmsg BEGIN
+        INSERT INTO archivedmsgindex(archivedmsgindex, rowid, text) VALUES ('delete', old.rowid, old.text);
+        INSERT INTO archivedmsgindex(rowid, text) VALUES (new.rowid, new.text);
+    END'''
+]
+
+class SyncState(Model):
+    com = CharField()
+    chat = CharField()
+    newest_id = CharField(null=True)
+    newest_time = IntegerField(null=True)
+    oldest_token = CharField(null=True)
+    done = BooleanField(default=False)
+
+    class Meta:
+        database = db
+        indexes = (
+            (('com', 'chat'), True),
+        )
+
 
 @contextmanager
 def query():
-    try:
-        db.connect()
-        yield
+    """
+    Connects to the database if it isn't already connected
 
-    # Database is already connected
-    except OperationalError:
-        yield
-    finally:
-        db.close()
+    The connection stays open, so each query doesn't pay the cost of opening the file again
+    """
 
+    db.connect(reuse_if_open=True)
+    yield
+
+
+_migrated = False
 
 class _DB:
     def __init__(self):
-        Account.create_table()
-        Update.create_table()
+        global _migrated
+
+        if _migrated:
+            return
+
+        with query():
+            if db.pragma('user_version') < SCHEMA_VERSION:
+                with db.atomic('IMMEDIATE'):
+                    db.create_tables([Account, Update, Media, Data, ArchivedMsg, ArchivedMsgIndex, SyncState])
+                    for trigger in _SEARCH_TRIGGERS:
+                        db.execute_sql(trigger)
+                    # Indexes the messages archived before the index existed
+                    ArchivedMsgIndex.rebuild()
+                    db.pragma('user_version', SCHEMA_VERSION)
+        _migrated = True
 
-    def add_account(self, email, sid):
+    def add_account(self, email, sid, change_in=None):
         with query():
-            Account(email=email, sid=sid, change_in=int(time())).save()
+            # Only the newest sid of each email is kept
+            Account.delete().where(Account.email == email).execute()
+            Account(email=email, sid=sid, change_in=change_in or int(time())).save()
 
     def get_account(self, email):
         with query():
@@ -63,6 +201,21 @@ class _DB:
             except Account.DoesNotExist:
                 return None
 
+    def get_session(self, email):
+        """
+        Returns the sid of email and when it was saved, even if it's expired
+        """
+
+        with query():
+            acc = (
+                Account
+                .select(Account.sid, Account.change_in)
+                .where(Account.email == email)
+                .order_by(Account.change_in.desc())
+                .first()
+            )
+            return (acc.sid, acc.change_in) if acc else None
+
     def update_time_of(self, attr):
         with query():
             up = Update.get()
@@ -91,5 +244,448 @@ class _DB:
                 self.update_time_of('deps')
                 return True
 
-class DB:
-    pass
\ No newline at end of file
+    def get_media(self, key, target):
+        """
+        Returns the link of a file already uploaded to target, or None
+
+        Links older than media_max_age are ignored, they are replaced
+        by the next add_media of the key or removed when there are too many links
+        """
+
+        with query():
+            media = Media.get_or_none(
+                Media.key == key,
+                Media.target == target,
+                Media.change_in > int(time()) - media_max_age
+            )
+            return media.link if media else None
+
+    def add_media(self, keys, target, link):
+        """
+        Saves the link returned by an upload under each key
+
+        Only the newest media_max_entries links are kept
+        """
+
+        with query():
+            with db.atomic():
+                now = int(time())
+                for key in keys:
+                    Media.replace(key=key, target=target, link=link, change_in=now).execute()
+
+                if Media.select().count() > media_max_entries:
+                    newest = Media.select(Media.id).order_by(Media.change_in.desc()).limit(media_max_entries)
+                    Media.delete().where(Media.id.not_in(newest)).execute()
+
+class AsyncDB:
+    """
+    Runs the methods of _DB outside the event loop
+
+    Reads run at the same time in the threads of EXECUTOR,
+    writes of every AsyncDB go to the same queue and are run one after another by a single writer,
+    which commits all the queued writes in one transaction
+
+    ```
+    db = AsyncDB()
+    sid = await db.get_account(email)
+    await db.add_account(email, sid)
+    ```
+    """
+
+    # Methods of _DB that only read, get_account is a write because it deletes an expired row
+    READS = {'get_session', 'get_media'}
+
+    def __init__(self, db: _DB | None = None):
+        self._db = db or _DB()
+
+    def __getattr__(self, name: str) -> Callable[..., Awaitable[Any]]:
+        if name.startswith('_'):
+            raise AttributeError(name)
+
+        func = getattr(self._db, name)
+        return partial(self.read if name in self.READS else self.write, func)
+
+    async def read(
+        self,
+        func:  Callable[..., Any],
+        *args: Any
+    ) -> Any:
+        return await EXECUTOR.thread(func, *args)
+
+    async def write(
+        self,
+        func:  Callable[..., Any],
+        *args: Any
+    ) -> Any:
+        global _writes, _writer, _writer_loop
+
+        loop = get_running_loop()
+
+        # The queue and the writer belong to the loop where they were created
+        if not _writer or _writer.done() or _writer_loop is not loop:
+            _writes = Queue()
+            _writer = loop.create_task(_write_all(_writes))
+            _writer_loop = loop
+
+        future = loop.create_future()
+        await _writes.put((func, args, future))
+        return await future
+
+
+# Shared by every AsyncDB, so only one thread writes to the database
+_writes:        Queue | None              = None
+_writer:        Task | None               = None
+_writer_loop:   AbstractEventLoop | None  = None
+_writer_thread: ThreadPoolExecutor | None = None
+
+async def _write_all(writes: Queue) -> None:
+    global _writer_thread
+
+    if not _writer_thread:
+        _writer_thread = ThreadPoolExecutor(1, thread_name_prefix='amsync-db')
+
+    loop = get_running_loop()
+    while True:
+        batch = [await writes.get()]
+        while not writes.empty():
+            batch.append(writes.get_nowait())
+
+        try:
+            results = await loop.run_in_executor(_writer_thread, _run_writes, batch)
+        except BaseException as e:
+            # The transaction itself failed (BEGIN, COMMIT, ...), so every write of the batch failed
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e if isinstance(e, Exception) else CancelledError())
+            if not isinstance(e, Exception):
+                raise
+            continue
+
+        for (_, _, future), (result, error) in zip(batch, results):
+            if future.done():
+                continue
+            if error:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+
+def _run_writes(writes: list) -> list[Tuple[Any, BaseException | None]]:
+    """
+    Runs writes in a single transaction, each one in a savepoint so an error only undoes its own write
+    """
+
+    results = []
+    with query():
+        # IMMEDIATE takes the write lock at BEGIN, instead of failing in the middle of the transaction
+        with db.atomic('IMMEDIATE'):
+            for func, args, _ in writes:
+                try:
+                    with db.atomic():
+                        results.append((func(*args), None))
+                except Exception as e:
+                    results.append((None, e))
+    return results
+
+
+class _Flusher:
+    """
+    Base of the classes that keep writes in memory and save them together with flush
+
+    Timed flushes run in the background, their errors are shown
+    and each failed flush waits twice as long before the next, up to a minute
+    """
+
+    def __init__(self, flush_every: float):
+        self.flush_every = flush_every
+
+        self._flush:   TimerHandle | None = None
+        self._tasks:   Set[Task]          = set()
+        self._retries: int                = 0
+        _flushers.add(self)
+
+    async def flush(self) -> None:
+        raise NotImplementedError
+
+    async def close(self) -> None:
+        """
+        Waits the flushes running in the background and saves what is still waiting
+
+        Called by the Bot when it stops
+        """
+
+        if self._tasks:
+            await gather(*self._tasks, return_exceptions=True)
+        await self.flush()
+
+    def _schedule(self) -> None:
+        if not self._flush:
+            loop = get_running_loop()
+            self._flush = loop.call_later(self.flush_every, self._flush_now)
+
+    def _retry(self) -> None:
+        self._retries += 1
+        if self._flush:
+            self._flush.cancel()
+        loop = get_running_loop()
+        self._flush = loop.call_later(min(self.flush_every * 2 ** self._retries, 60), self._flush_now)
+
+    def _flush_now(self) -> None:
+        if self._flush:
+            self._flush.cancel()
+            self._flush = None
+        # The reference keeps the task from being garbage collected while it runs
+        task = get_running_loop().create_task(self.flush())
+        self._tasks.add(task)
+        task.add_done_callback(self._flushed)
+
+    def _flushed(self, task: Task) -> None:
+        self._tasks.discard(task)
+        if not task.cancelled() and (e := task.exception()):
+            print(f'{type(self).__name__}.flush failed, trying again later: {e!r}', file=sys.stderr)
+
+
+# DB and Archive created, saved by close_all
+_flushers: WeakSet[_Flusher] = WeakSet()
+
+async def close_all() -> None:
+    """
+    Saves what every DB and Archive is still waiting to save
+    """
+
+    await gather(*(i.close() for i in list(_flushers)))
+
+
+class DB(_Flusher):
+    """
+    Stores data of the bot (xp, warnings, settings, ...) by community, chat and user
+
+    Values can be anything that ujson saves: numbers, strings, lists, dicts, ...
+
+    Changes are kept in memory and saved together, in one transaction, every flush_every seconds,
+    so increasing the xp on every message doesn't write to the disk on every message
+
+    ```
+    db = DB()
+
+    @bot.on()
+    async def message(m: Msg):
+        xp = await db.incr('xp', 5, com=m.com, uid=m.uid)
+
+    @bot.add()
+    async def prefix(m: Msg):
+        db.set('prefix', m.text, com=m.com, chat=m.chat)
+    ```
+
+    Changing a list or dict returned by get doesn't save it, use set after changing it
+
+    #### flush_every
+    Seconds between saves
+
+    #### cache_size
+    Maximum values kept in memory to be read again, the least used are removed first
+    """
+
+    def __init__(
+        self,
+        flush_every: float = 0.5,
+        cache_size:  int   = 10000
+    ):
+        super().__init__(flush_every)
+        self.cache_size = cache_size
+
+        self._db:     AsyncDB                  = AsyncDB()
+        self._cache:  OrderedDict[tuple, Any]  = OrderedDict()
+        # json of the values waiting to be saved, or _DELETED
+        self._dirty:  Dict[tuple, Any]         = {}
+
+    async def get(
+        self,
+        key:     str,
+        default: Any        = None,
+        *,
+        com:     str | None = None,
+        chat:    str | None = None,
+        uid:     str | None = None
+    ) -> Any:
+        """
+        Returns the value of key, or default if it doesn't exist
+        """
+
+        k = _key(key, com, chat, uid)
+        value = await self._load(k)
+        return default if value is _DELETED else value
+
+    def set(
+        self,
+        key:   str,
+        value: Any,
+        *,
+        com:   str | None = None,
+        chat:  str | None = None,
+        uid:   str | None = None
+    ) -> None:
+        """
+        Changes the value of key, it's saved on the next flush
+
+        Values that can't be saved as json raise TypeError here, not on the flush
+        """
+
+        self._change(_key(key, com, chat, uid), value)
+
+    def delete(
+        self,
+        key:  str,
+        *,
+        com:  str | None = None,
+        chat: str | None = None,
+        uid:  str | None = None
+    ) -> None:
+        """
+        Deletes key, it's deleted from the disk on the next flush
+        """
+
+        self._change(_key(key, com, chat, uid), _DELETED)
+
+    async def incr(
+        self,
+        key:    str,
+        amount: int | float = 1,
+        *,
+        com:    str | None  = None,
+        chat:   str | None  = None,
+        uid:    str | None  = None
+    ) -> int | float:
+        """
+        Adds amount to the value of key (0 if it doesn't exist) and returns the new value
+
+        Concurrent incr never lose an increment, as the sum happens without waiting anything
+        """
+
+        k = _key(key, com, chat, uid)
+        value = await self._load(k)
+
+        # Nothing is awaited from here, so no other incr runs between the read and the change
+        if k in self._cache:
+            value = self._cache[k]
+        elif k in self._dirty:
+            value = _loads(self._dirty[k])
+        value = (0 if value is _DELETED else value) + amount
+
+        self._change(k, value)
+        return value
+
+    async def all(
+        self,
+        key:  str,
+        *,
+        com:  str | None = None,
+        chat: str | None = None
+    ) -> Dict[str, Any]:
+        """
+        Returns the value of key of every user of the community/chat
+
+        ```
+        xp = await db.all('xp', com=m.com)
+        top = sorted(xp.items(), key=lambda i: i[1], reverse=True)[:10]
+        ```
+        """
+
+        await self.flush()
+        return await self._db.read(_load_all, key, com or '', chat or '')
+
+    async def flush(self) -> None:
+        """
+        Saves the pending changes now
+        """
+
+        if self._flush:
+            self._flush.cancel()
+            self._flush = None
+        if not self._dirty:
+            return
+
+        changes, self._dirty = self._dirty, {}
+        try:
+            await self._db.write(_save_data, changes)
+        except BaseException:
+            # Keep the changes to save in the next flush, unless they were changed again
+            self._dirty = {**changes, **self._dirty}
+            self._retry()
+            raise
+        self._retries = 0
+
+    async def _load(self, k: tuple) -> Any:
+        if k in self._cache:
+            self._cache.move_to_end(k)
+            return self._cache[k]
+
+        if k in self._dirty:
+            return _loads(self._dirty[k])
+
+        value = await self._db.read(_load_data, k)
+        # While reading, the value may have been changed or loaded by another call
+        if k not in self._dirty and k not in self._cache:
+            self._remember(k, value)
+        return value
+
+    def _change(self, k: tuple, value: Any) -> None:
+        # Serialized now, so a value that can't be saved fails here instead of every flush
+        self._dirty[k] = value if value is _DELETED else dumps(value)
+        self._remember(k, value)
+        self._schedule()
+
+    def _remember(self, k: tuple, value: Any) -> None:
+        # Values waiting to be saved stay in _dirty, so they can leave the cache
+        self._cache[k] = value
+        self._cache.move_to_end(k)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+
+# Marks a deleted (or missing) value of DB
+_DELETED = object()
+
+def _loads(value: Any) -> Any:
+    return value if value is _DELETED else loads(value)
+
+def _key(
+    key:  str,
+    com:  str | None,
+    chat: str | None,
+    uid:  str | None
+) -> Tuple[str, str, str, str]:
+    return str(com or ''), str(chat or ''), str(uid or ''), key
+
+def _load_data(k: Tuple[str, str, str, str]) -> Any:
+    com, chat, uid, key = k
+    with query():
+        row = (
+            Data
+            .select(Data.value)
+            .where(Data.com == com, Data.chat == chat, Data.uid == uid, Data.key == key)
+            .first()
+        )
+    return loads(row.value) if row else _DELETED
+
+def _load_all(key: str, com: str, chat: str) -> Dict[str, Any]:
+    with query():
+        rows = Data.select(Data.uid, Data.value).where(Data.key == key, Data.com == com, Data.chat == chat)
+        return {row.uid: loads(row.value) for row in rows}
+
+def _save_data(changes: Dict[tuple, Any]) -> None:
+    """
+    Saves the changes of DB, it runs inside the transaction of the AsyncDB writer
+    """
+
+    rows = [
+        {'com': com, 'chat': chat, 'uid': uid, 'key': key, 'value': value}
+        for (com, chat, uid, key), value in changes.items()
+        if value is not _DELETED
+    ]
+    # SQLite has a limit of variables per query
+    for i in range(0, len(rows), 100):
+        Data.insert_many(rows[i:i+100]).on_conflict_replace().execute()
+
+    for com, chat, uid, key in [k for k, v in changes.items() if v is _DELETED]:
+        Data.delete().where(Data.com == com, Data.chat == chat, Data.uid == uid, Data.key == key).execute()
@@ -11,4 +11,6 @@ class AminoSays(Exception): pass
 class EmptyCom(Exception): pass
 class InvalidRole(Exception): pass
 class InvalidPythonVersion(Exception): pass
-class FontNotFound(Exception): pass
\ No newline at end of file
+class FontNotFound(Exception): pass
+class FileTooLarge(Exception): pass
+class ImageTooLarge(Exception): pass
\ No newline at end of file
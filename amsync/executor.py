@@ -0,0 +1,179 @@
+from __future__ import annotations
+
+from os import cpu_count
+from time import perf_counter
+from typing import Any, Callable, Dict
+from asyncio import sleep, get_running_loop, Task
+from functools import partial
+from multiprocessing import get_context
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+__all__ = [
+    'Executor',
+    'EXECUTOR'
+]
+
+
+class Executor:
+    """
+    Runs CPU-bound work (base64, Pillow, ...) outside the event loop thread
+
+    #### threads, processes
+    Maximum workers of each pool, the pools are only created on first use
+
+    #### threshold
+    Work smaller than this many bytes runs in the loop thread,
+    because sending it to a thread costs more than running it
+
+    ```
+    from amsync import EXECUTOR
+
+    b64 = await EXECUTOR.thread(File.b64, b)
+    img = await EXECUTOR.process(render, data)
+    ```
+    """
+
+    def __init__(
+        self,
+        threads:   int | None = None,
+        processes: int | None = None,
+        threshold: int        = 256 * 1024
+    ):
+        self.threads   = threads or min(32, (cpu_count() or 1) + 4)
+        self.processes = processes or cpu_count() or 1
+        self.threshold = threshold
+
+        self._thread_pool:  ThreadPoolExecutor  | None = None
+        self._process_pool: ProcessPoolExecutor | None = None
+        self._watcher:      Task                | None = None
+
+        self.stats: Dict[str, int | float] = {
+            'inline':          0,    # calls that ran in the loop thread
+            'thread':          0,
+            'process':         0,
+            'inline_time':     0.0,  # seconds the loop was blocked by inline calls
+            'max_inline_time': 0.0,
+            'lag_checks':      0,    # filled by Executor.watch
+            'lag_time':        0.0,
+            'max_lag':         0.0,
+            'blocked':         0,
+        }
+
+    async def thread(
+        self,
+        func:     Callable[..., Any],
+        *args:    Any,
+        **kwargs: Any
+    ) -> Any:
+        """
+        Runs func in the thread pool
+        """
+
+        if not self._thread_pool:
+            self._thread_pool = ThreadPoolExecutor(self.threads, thread_name_prefix='amsync')
+
+        self.stats['thread'] += 1
+        return await get_running_loop().run_in_executor(self._thread_pool, partial(func, *args, **kwargs))
+
+    async def process(
+        self,
+        func:     Callable[..., Any],
+        *args:    Any,
+        **kwargs: Any
+    ) -> Any:
+        """
+        Runs func in the process pool
+
+        func, args and the return must be picklable, so func must be defined at module level
+        """
+
+        if not self._process_pool:
+            # fork copies the threads of the bot (event loop, EXECUTOR, db) in the middle of what they do,
+            # which can deadlock the new process
+            self._process_pool = ProcessPoolExecutor(self.processes, mp_context=get_context('spawn'))
+
+        self.stats['process'] += 1
+        return await get_running_loop().run_in_executor(self._process_pool, partial(func, *args, **kwargs))
+
+    async def run(
+        self,
+        func:     Callable[..., Any],
+        *args:    Any,
+        nbytes:   int,
+        **kwargs: Any
+    ) -> Any:
+        """
+        Runs func in the thread pool if nbytes >= threshold, otherwise runs it in the loop thread
+
+        #### nbytes
+        Amount of bytes that func will process (not called size, so func can have a size argument)
+        """
+
+        if nbytes >= self.threshold:
+            return await self.thread(func, *args, **kwargs)
+
+        start = perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            took = perf_counter() - start
+            self.stats['inline'] += 1
+            self.stats['inline_time'] += took
+            self.stats['max_inline_time'] = max(self.stats['max_inline_time'], took)
+
+    def watch(
+        self,
+        interval:  float = 0.1,
+        threshold: float = 0.05
+    ) -> Task:
+        """
+        Starts measuring how long the event loop is blocked
+
+        Every interval seconds checks how late the loop woke up,
+        delays bigger than threshold are counted in stats['blocked']
+
+        ```
+        @bot.on()
+        async def ready():
+            EXECUTOR.watch()
+        ```
+        """
+
+        async def foo():
+            loop = get_running_loop()
+            while True:
+                start = loop.time()
+                await sleep(interval)
+                lag = loop.time() - start - interval
+
+                self.stats['lag_checks'] += 1
+                self.stats['lag_time'] += lag
+                self.stats['max_lag'] = max(self.stats['max_lag'], lag)
+                if lag >= threshold:
+                    self.stats['blocked'] += 1
+
+        if not self._watcher or self._watcher.done():
+            self._watcher = get_running_loop().create_task(foo())
+        return self._watcher
+
+    def shutdown(self, wait: bool = True) -> None:
+        """
+        Stops the pools and the watch
+        """
+
+        if self._watcher:
+            self._watcher.cancel()
+            self._watcher = None
+        if self._thread_pool:
+            self._thread_pool.shutdown(wait)
+            self._thread_pool = None
+        if self._process_pool:
+            self._process_pool.shutdown(wait)
+            self._process_pool = None
+
+
+# # # # # # #
+#   Cache   #
+# # # # # # #
+
+EXECUTOR = Executor()
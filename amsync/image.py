@@ -1,23 +1,41 @@
 from __future__ import annotations
 
 from io import BytesIO
-from PIL import Image, ImageDraw, ImageFont, ImageOps
-from typing import Tuple
+from copy import copy
+from math import ceil
+from time import perf_counter
+from uuid import uuid4
+from PIL import Image, ImageChops, ImageDraw, ImageFont, ImageOps
+from typing import Any, Callable, Iterator, Tuple
 from pathlib import Path
+from hashlib import sha1
+from asyncio import Semaphore, gather
+from functools import lru_cache
+from threading import Lock
+from collections import OrderedDict
 from filetype import guess_mime
 
-from .exceptions import FontNotFound
+from .obj import File
+from .executor import EXECUTOR
+from .exceptions import FontNotFound, ImageTooLarge
 
 
 __all__ = [
     'Color',
     'MakeImage',
-    'ProgressBar'
+    'ProgressBar',
+    'Render',
+    'Template',
+    'Field',
+    'Grid'
 ]
 
 Size = Tuple[int, int]
 RGBA = Tuple[int, int, int, int]
 
+# Default limit of MakeImage.decode, 0 disables it
+max_image_pixels = 40_000_000
+
 class Color:
     RED    = (255, 0, 0, 255)
     GREEN  = (0, 255, 0, 255)
@@ -54,6 +72,111 @@ class MakeImage:
         self.save(arr)
         return arr.getvalue()
 
+    @property
+    def raw_size(self) -> int:
+        """
+        Bytes used by the decoded image, used to decide if an operation runs outside the event loop
+        """
+
+        w, h = self.size
+        return w * h * len(self.img.getbands())
+
+    @classmethod
+    def decode(
+        cls,
+        img:        bytes | str,
+        size:       Size | None = None,
+        max_pixels: int | None  = None
+    ) -> MakeImage:
+        """
+        Decodes the bytes or path of an image
+
+        #### size
+        The size that the image will have, the image is decoded directly in a smaller size
+        (but never smaller than size), which is much faster for big photos,
+        after that use resize, crop, ... as usual
+
+        #### max_pixels
+        Images with more pixels raise ImageTooLarge, this is checked only with the header of the image,
+        before decoding it. By default max_image_pixels, 0 disables the limit
+
+        ```
+        icon = MakeImage.decode(await File.get(m.file_link), (165, 165))
+        icon.resize((165, 165))
+        ```
+        """
+
+        im = Image.open(BytesIO(img) if isinstance(img, bytes) else img)
+
+        w, h = im.size
+        max_pixels = max_image_pixels if max_pixels is None else max_pixels
+        if max_pixels and w * h > max_pixels:
+            raise ImageTooLarge(f'The image has {w}x{h} pixels, the limit is {max_pixels}')
+
+        if size:
+            # Only jpegs can be decoded in 1/2, 1/4 or 1/8 of the size
+            im.draft(im.mode, size)
+
+            factor = min(im.width // size[0], im.height // size[1])
+            if factor >= 2 and not getattr(im, 'is_animated', False):
+                try:
+                    im = im.reduce(factor)
+                except ValueError:
+                    # reduce doesn't support some modes, like P (gifs), 1 and I;16
+                    im = im.convert('RGBA').reduce(factor)
+
+        im.load()
+        return cls(im)
+
+    @classmethod
+    async def load(
+        cls,
+        b:          bytes,
+        size:       Size | None = None,
+        max_pixels: int | None  = None
+    ) -> MakeImage:
+        """
+        Same as MakeImage.decode, but decodes big images outside the event loop
+
+        Images with more than max_pixels (by default max_image_pixels) raise ImageTooLarge
+        """
+
+        w, h = Image.open(BytesIO(b)).size
+        return await EXECUTOR.run(cls.decode, b, size, max_pixels, nbytes=w * h * 4)
+
+    async def run(
+        self,
+        method:   str,
+        *args:    Any,
+        **kwargs: Any
+    ) -> Any:
+        """
+        Calls a method of the image, outside the event loop if the image is bigger than EXECUTOR.threshold
+
+        ```
+        await img.run('resize', (500, 500))
+        await img.run('circular_thumbnail')
+        ```
+        """
+
+        return await EXECUTOR.run(getattr(self, method), *args, nbytes=self.raw_size, **kwargs)
+
+    async def to_bytes(
+        self,
+        format:  str        = 'webp',
+        quality: int | None = None
+    ) -> bytes:
+        """
+        Same as MakeImage.bytes, but encodes big images outside the event loop
+        """
+
+        def foo() -> bytes:
+            arr = BytesIO()
+            self.save(arr, format, quality)
+            return arr.getvalue()
+
+        return await EXECUTOR.run(foo, nbytes=self.raw_size)
+
     @staticmethod
     def type(b) -> str:
         # Only first 261 bytes representing the max file header is required
@@ -77,14 +200,38 @@ class MakeImage:
     def convert(cls, im: Image.Image) -> MakeImage:
         return cls(im)
 
+    @staticmethod
+    def lazy(img: bytes | str) -> Render:
+        """
+        Returns a Render of the image, where the operations only run on Render.bytes or Render.save
+
+        Before running, the operations are optimized: consecutive resizes become one,
+        crops after a resize only resize the cropped part,
+        and jpegs are decoded directly in a smaller size when they are going to be reduced
+
+        ```
+        im = MakeImage.lazy(await File.get(m.file_link))
+        im.resize((1000, 1000))
+        im.crop((500, 500))
+        await bot.send(files=im.bytes)
+        ```
+        """
+
+        return Render(img, optimize=True)
+
     def get_text_pos(
         self,
         draw: ImageDraw.Draw,
         text: str,
         font: ImageFont.truetype
     ) -> Size:
+        """
+        Returns the space left around text
 
-        w, h = draw.textsize(text, font=font)
+        draw isn't used anymore (the size is measured once per text and font), it's kept for compatibility
+        """
+
+        w, h = _text_size(text, font)
         W, H = self.size
         return W-w, H-h
 
@@ -104,6 +251,21 @@ class MakeImage:
         else:
             self.img = self.img.resize(size, Image.BICUBIC)
 
+    def _resize_box(
+        self,
+        size: Size,
+        box:  Tuple[float, float, float, float]
+    ) -> None:
+        """
+        Resizes only the part box of the image, box is in fractions of the image size
+
+        Used by Render to join resizes and crops
+        """
+
+        W, H = self.size
+        x0, y0, x1, y1 = box
+        self.img = self.img.resize(size, Image.BICUBIC, (x0*W, y0*H, x1*W, y1*H), reducing_gap=2.0)
+
     def crop(self, size: Size) -> None:
         W, H   = self.size
         cw, ch = W//2, H//2
@@ -131,6 +293,110 @@ class MakeImage:
         else:
             self.img.save(path, format, quality=quality)
 
+    def encode(
+        self,
+        max_bytes: int | None     = None,
+        latency:   float | None   = None,
+        format:    str | None     = None,
+        buffer:    BytesIO | None = None
+    ) -> bytes:
+        """
+        Returns the bytes of the image in the format and quality that best fits max_bytes
+
+        Images with up to 256 colors (texts, cards, flat graphics) are saved without loss,
+        as png with palette (if they don't have transparency) or lossless webp, whichever is smaller
+
+        Other images (or flat ones that don't fit) are saved as webp (or jpeg if format='jpeg')
+        with the biggest quality that fits in max_bytes, if nothing fits, the smallest is returned
+
+        #### latency
+        Seconds to stop trying other qualities, also uses the fastest webp method
+
+        #### format
+        Only tries this format: 'webp', 'png' or 'jpeg'
+
+        A png that doesn't fit without loss is saved with the colors reduced to a palette of 256
+
+        #### buffer
+        Where the images are written, to reuse the same memory in many encodes
+        """
+
+        start  = perf_counter()
+        buffer = buffer or BytesIO()
+        method = 0 if latency else 4
+        format = 'jpeg' if format == 'jpg' else format and format.lower()
+        img    = self.img if self.img.mode in ('RGB', 'RGBA') else self.img.convert('RGBA')
+
+        # Position and size of the best image in buffer, and whether it fits in max_bytes
+        best = [0, 0, False]
+
+        def save(
+            im:         Image.Image,
+            format:     str,
+            newer_wins: bool = False,
+            **kwargs
+        ) -> bool:
+            """
+            Writes im after the best image, so the best is never copied, and returns if it fits
+
+            Of two images that fit the smaller is kept, or the newer with newer_wins
+            """
+
+            pos, size, best_fits = best
+            buffer.seek(pos + size)
+            buffer.truncate()
+            im.save(buffer, format, **kwargs)
+
+            new = buffer.tell() - pos - size
+            fits = not max_bytes or new <= max_bytes
+            if not size or fits > best_fits or fits == best_fits and (new < size or fits and newer_wins):
+                best[:] = [pos + size, new, fits]
+            return fits
+
+        def out_of_time() -> bool:
+            return latency is not None and perf_counter() - start >= latency
+
+        def result() -> bytes:
+            buffer.seek(best[0])
+            return buffer.read(best[1])
+
+        if format == 'png':
+            if exact := _palette(img):
+                save(exact, 'png', optimize=not latency)
+            elif not save(img, 'png', optimize=not latency) and not out_of_time():
+                save(img.quantize(256, Image.FASTOCTREE), 'png', optimize=not latency)
+            return result()
+
+        if format in (None, 'webp') and img.getcolors(256):
+            if format is None and (exact := _palette(img)):
+                save(exact, 'png', optimize=not latency)
+            if not (best[1] and out_of_time()):
+                save(img, 'webp', lossless=True, method=method)
+
+            if best[2] or out_of_time():
+                return result()
+
+        # Of the images that fit, the newer has a bigger quality
+        if format == 'jpeg':
+            rgb = img.convert('RGB')
+            lossy = lambda q: save(rgb, 'jpeg', True, quality=q, optimize=not latency)
+        else:
+            lossy = lambda q: save(img, 'webp', True, quality=q, method=method)
+
+        # Binary search of the biggest quality that fits
+        if lossy(90):
+            return result()
+
+        low, high = 10, 89
+        while low <= high and not out_of_time():
+            quality = (low + high) // 2
+            if lossy(quality):
+                low = quality + 1
+            else:
+                high = quality - 1
+
+        return result()
+
     @staticmethod
     def calc(
         size:     Size, 
@@ -162,23 +428,33 @@ class MakeImage:
         stroke_color: RGBA | Color           = Color.BLACK,
     ) -> None:
 
-        draw = ImageDraw.Draw(self.img)
         if font:
             if not font[0] or not font[1]:
                 raise Exception('No font-file or font-size')
-            if not Path(font[0]).exists():
-                raise FontNotFound(f"Font '{font[0]}' was not found in the current folder")
-            font = ImageFont.truetype(*font)
-
-        w, h = self.get_text_pos(draw, text, font)
-        draw.text(
-            self.calc((w, h), move=move, position=position),
-            text,
-            font         = font,
-            fill         = color,
-            stroke_width = stroke,
-            stroke_fill  = stroke_color,
-        )
+            font = _font(*font)
+
+        # Same as get_text_pos, without its unused draw
+        w, h = _text_size(text, font)
+        W, H = self.size
+        x, y = self.calc((W-w, H-h), move=move, position=position)
+
+        if self.img.mode not in ('RGB', 'RGBA'):
+            ImageDraw.Draw(self.img).text(
+                (x, y),
+                text,
+                font         = font,
+                fill         = color,
+                stroke_width = stroke,
+                stroke_fill  = stroke_color,
+            )
+            return
+
+        # Pasting the color through the cached masks is the same as what ImageDraw.text does,
+        # without rendering the glyphs again
+        (left, top), mask, stroke_mask = _text_masks(text, font, stroke)
+        if stroke_mask:
+            self.img.paste(stroke_color, (x+left, y+top), stroke_mask)
+        self.img.paste(color, (x+left, y+top), mask)
 
     def paste(
         self,
@@ -201,24 +477,153 @@ class MakeImage:
 
 
     def circular_thumbnail(self) -> None:
-        w, h = self.size
-        w, h = w*3, h*3
-        mask = Image.new('L', (w, h), 0)
-
-        # Place the entire mask in the center of the image,
-        # without the 5, part of the mask's edges is slightly cut
-        ImageDraw.Draw(mask).ellipse((5, 5, w-5, h-5), fill=255)
-        mask = mask.resize(self.size, Image.BICUBIC)
+        mask = _circle_mask(self.size)
         self.img = ImageOps.fit(self.img, mask.size, Image.BICUBIC)
         self.img.putalpha(mask)
 
+    @property
+    def n_frames(self) -> int:
+        """
+        Number of frames, 1 if the image isn't animated
+        """
+
+        return getattr(self.img, 'n_frames', 1)
+
     def to_img(self, n_frame: int = 0) -> MakeImage:
-        self.img.seek(n_frame)
-        self.save('tmp.webp')
-        with open('tmp.webp', 'rb') as tmp:
-            tmp = MakeImage(tmp.read())
-        Path('tmp.webp').unlink(missing_ok=True)
-        return tmp
+        """
+        Returns the frame n_frame of an animated image (gif, webp) as a static image
+        """
+
+        actual = self.img.tell()
+        try:
+            self.img.seek(n_frame)
+            return MakeImage(self.img.convert('RGBA'))
+        finally:
+            self.img.seek(actual)
+
+    def frames(
+        self,
+        start: int        = 0,
+        stop:  int | None = None,
+        step:  int        = 1
+    ) -> Iterator[MakeImage]:
+        """
+        Yields the frames of an animated image as static images, one by one
+
+        Only the frames that are yielded are converted, so stopping early
+        or skipping frames with step doesn't process the others
+
+        The duration of each frame is in frame.img.info['duration']
+
+        ```
+        for frame in MakeImage(gif).frames(step=2):
+            ...
+        ```
+        """
+
+        stop = self.n_frames if stop is None else min(stop, self.n_frames)
+        actual = self.img.tell()
+        try:
+            for n in range(start, stop, step):
+                self.img.seek(n)
+                yield MakeImage(self.img.convert('RGBA'))
+        finally:
+            self.img.seek(actual)
+
+    def animate(
+        self,
+        ops:        Render | Callable[[MakeImage], MakeImage | None],
+        format:     str | None = None,
+        quality:    int | None = None,
+        fps:        int | None = None,
+        max_frames: int | None = None,
+        max_bytes:  int | None = None,
+        max_memory: int | None = 256 * 1024 * 1024
+    ) -> bytes:
+        """
+        Applies ops to every frame of an animated image and returns the bytes of the new animation
+
+        Each frame is decoded and edited only once, but the encoders of Pillow (gif and webp)
+        need all the frames before writing, so the edited frames are kept in memory until then
+
+        #### ops
+        A Render without image, whose operations are applied to each frame,
+        or a function that receives the frame
+
+        #### format
+        By default the same format of the image
+
+        #### fps, max_frames
+        Frames are merged (the duration of the removed frames goes to the previous frame)
+        until the animation has at most fps frames per second and max_frames frames
+
+        #### max_bytes
+        While the animation is bigger than this, half of the frames are removed
+
+        #### max_memory
+        Maximum bytes of the edited frames kept in memory, when they pass it half of the frames are removed
+
+        ```
+        ops = Render().resize((165, 165)).circular_thumbnail().add_border(2, Color.BLACK)
+        await bot.send(files=MakeImage(await File.get(m.icon)).animate(ops, max_bytes=500_000))
+        ```
+        """
+
+        format = (format or self.img.format or 'webp').lower()
+        if isinstance(ops, Render):
+            ops = ops.apply
+
+        min_duration = 1000 / fps if fps else 0
+        step = -(-self.n_frames // max_frames) if max_frames else 1
+
+        frames:    list[Image.Image] = []
+        durations: list[int]         = []
+        first = 0
+        used = 0
+
+        # The durations are read in the same pass that edits the frames,
+        # frames that are merged into the previous one are only decoded
+        actual = self.img.tell()
+        try:
+            for n in range(self.n_frames):
+                self.img.seek(n)
+                duration = self.img.info.get('duration') or 100
+
+                if frames and (n - first < step or durations[-1] < min_duration):
+                    durations[-1] += duration
+                    continue
+
+                frame = MakeImage(self.img.convert('RGBA'))
+                frames.append((ops(frame) or frame).img)
+                durations.append(duration)
+                first = n
+
+                used += len(frames[-1].getbands()) * frames[-1].width * frames[-1].height
+                if max_memory and used > max_memory and len(frames) > 1:
+                    frames, durations = _halve(frames, durations)
+                    used = sum(len(i.getbands()) * i.width * i.height for i in frames)
+                    step *= 2
+        finally:
+            self.img.seek(actual)
+
+        loop = self.img.info.get('loop', 0)
+        while True:
+            arr = BytesIO()
+            frames[0].save(
+                arr,
+                format,
+                save_all      = True,
+                append_images = frames[1:],
+                duration      = durations,
+                loop          = loop,
+                disposal      = 2,
+                quality       = quality or 80
+            )
+
+            if not max_bytes or arr.tell() <= max_bytes or len(frames) == 1:
+                return arr.getvalue()
+            # The edited frames are reused, nothing is decoded again
+            frames, durations = _halve(frames, durations)
 
     def add_border(
         self,
@@ -228,13 +633,15 @@ class MakeImage:
 
         W, H = self.size
 
-        mask = self.img.copy().resize((W + size*2, H + size*2))
-        fill = Image.new('RGBA', (W + size*2, H + size*2), color)
-        bg = Image.new('RGBA', (W + size*2, H + size*2), Color.TRANSPARENT)
+        if self.img.mode == 'RGBA':
+            bg = _border(self.img.getchannel('A'), size, tuple(color)).copy()
+        else:
+            mask = self.img.copy().resize((W + size*2, H + size*2))
+            fill = Image.new('RGBA', (W + size*2, H + size*2), color)
+            bg = Image.new('RGBA', (W + size*2, H + size*2), Color.TRANSPARENT)
+            bg.paste(fill, mask=mask)
 
         w, h = bg.size
-
-        bg.paste(fill, mask=mask)
         bg.paste(self.img, ((w-W)//2, (h-H)//2), self.img)
 
         self.img = bg
@@ -252,28 +659,550 @@ class ProgressBar(MakeImage):
         bg_color: RGBA | Color = Color.PRETTY_BLACK
     ):
     
-        self.img = Image.new('RGBA', size, Color.TRANSPARENT)
+        self.img = _progress_bar(tuple(size), radius, tuple(bg_color)).copy()
         self.radius = radius
         self.color = color
         self.bg = bg_color
 
-        ImageDraw.Draw(self.img).rounded_rectangle(
-            (0, 0, *size), radius, bg_color
-        )
-
     def fill(self, px: int) -> None:
+        """
+        Paints with color the pixels of the bar that still have bg_color, from the left until px*2
+        """
+
         w, h = self.img.size
+        box = (0, 0, min(px*2, w), h)
+        if box[2] <= 0:
+            return
+
+        # Pixels equal to bg_color are the ones without difference in all bands
+        region = self.img.crop(box)
+        bands = ImageChops.difference(region, Image.new(region.mode, region.size, self.bg)).split()
+        diff = bands[0]
+        for band in bands[1:]:
+            diff = ImageChops.lighter(diff, band)
+        alpha = self.color[3] if len(self.color) == 4 else 255
+        mask = diff.point(lambda v: alpha if v == 0 else 0)
+
+        self.img.paste(self.color, box, mask)
+
+
+def _halve(
+    frames:    list[Image.Image],
+    durations: list[int]
+) -> Tuple[list[Image.Image], list[int]]:
+    """
+    Removes every second frame, its duration goes to the previous frame
+    """
+
+    return frames[::2], [sum(durations[i:i+2]) for i in range(0, len(durations), 2)]
+
+def _palette(img: Image.Image) -> Image.Image | None:
+    """
+    Returns img with a palette of its own colors, without changing any pixel,
+    None if it has transparency, more than 256 colors, or the palette isn't exact
+    """
+
+    if img.mode == 'RGBA':
+        if img.getchannel('A').getextrema()[0] < 255:
+            return None
+        img = img.convert('RGB')
+
+    if not img.getcolors(256):
+        return None
+
+    # With up to 256 colors the median cut keeps every color,
+    # the comparison is cheap and makes sure no pixel changed
+    p = img.quantize(256, Image.MEDIANCUT, dither=Image.NONE)
+    return p if p.convert('RGB').tobytes() == img.tobytes() else None
+
+@lru_cache(maxsize=128)
+def _circle_mask(size: Size) -> Image.Image:
+    w, h = size
+    w, h = w*3, h*3
+    mask = Image.new('L', (w, h), 0)
+
+    # Place the entire mask in the center of the image,
+    # without the 5, part of the mask's edges is slightly cut
+    ImageDraw.Draw(mask).ellipse((5, 5, w-5, h-5), fill=255)
+    return mask.resize(size, Image.BICUBIC)
+
+_borders: OrderedDict[Tuple[bytes, Size, int, RGBA], Image.Image] = OrderedDict()
+# Grid makes icons in the threads of EXECUTOR at the same time
+_borders_lock = Lock()
+
+def _border(
+    alpha: Image.Image,
+    size:  int,
+    color: RGBA
+) -> Image.Image:
+    """
+    Returns the border layer of add_border, which only depends on the transparency of the image
+
+    The layers are cached by a hash of the transparency, so the border of images
+    with the same shape, like circular thumbnails, is only made once
+    """
+
+    key = (sha1(alpha.tobytes()).digest(), alpha.size, size, color)
+    with _borders_lock:
+        if key in _borders:
+            _borders.move_to_end(key)
+            return _borders[key]
+
+    W, H = alpha.size
+    mask = alpha.resize((W + size*2, H + size*2))
+    bg = Image.new('RGBA', mask.size, Color.TRANSPARENT)
+    bg.paste(Image.new('RGBA', mask.size, color), mask=mask)
+
+    with _borders_lock:
+        _borders[key] = bg
+        if len(_borders) > 128:
+            _borders.popitem(last=False)
+    return bg
+
+@lru_cache(maxsize=32)
+def _font(path: str, size: int) -> ImageFont.FreeTypeFont:
+    """
+    Loads each font file only once per size
+    """
+
+    if not Path(path).exists():
+        raise FontNotFound(f"Font '{path}' was not found in the current folder")
+    return ImageFont.truetype(path, size)
+
+# Only used to measure texts
+_draw = ImageDraw.Draw(Image.new('L', (1, 1)))
+
+@lru_cache(maxsize=4096)
+def _text_size(
+    text: str,
+    font: ImageFont.FreeTypeFont | None
+) -> Size:
+
+    # ImageDraw.textsize was removed in Pillow 10
+    if hasattr(_draw, 'textsize'):
+        return _draw.textsize(text, font=font)
+    return _draw.textbbox((0, 0), text, font=font)[2:]
+
+@lru_cache(maxsize=1024)
+def _text_masks(
+    text:   str,
+    font:   ImageFont.FreeTypeFont | None,
+    stroke: int
+) -> Tuple[Size, Image.Image, Image.Image | None]:
+    """
+    Renders the glyphs of text once, so repeated texts (numbers, nicknames, ...) are only pasted
+
+    Returns the offset of the masks from the text position, the mask of the text and the mask of the stroke
+    """
+
+    left, top, right, bottom = _draw.textbbox((0, 0), text, font=font, stroke_width=stroke)
+    left, top = min(left, 0), min(top, 0)
+    size = (max(right - left, 1), max(bottom - top, 1))
+
+    mask = Image.new('L', size, 0)
+    ImageDraw.Draw(mask).text((-left, -top), text, font=font, fill=255)
+
+    stroke_mask = None
+    if stroke:
+        stroke_mask = Image.new('L', size, 0)
+        ImageDraw.Draw(stroke_mask).text((-left, -top), text, font=font, fill=255, stroke_width=stroke, stroke_fill=255)
+    return (left, top), mask, stroke_mask
+
+@lru_cache(maxsize=64)
+def _progress_bar(
+    size:     Size,
+    radius:   int,
+    bg_color: RGBA
+) -> Image.Image:
+    """
+    Returns the empty bar, which is the same for every ProgressBar with the same size, radius and bg_color
+    """
+
+    img = Image.new('RGBA', size, Color.TRANSPARENT)
+    ImageDraw.Draw(img).rounded_rectangle(
+        (0, 0, *size), radius, bg_color
+    )
+    return img
+
+
+class Render:
+    """
+    Describes the operations of a MakeImage, so the image can be made in another process
+
+    Any method of MakeImage (or ProgressBar, when created with Render.progress_bar) can be called,
+    the call is only saved, and everything runs in the process pool of EXECUTOR on Render.render
+
+    A Render can be pasted in another Render
+
+    ```
+    icon = Render(await File.get(m.icon)).resize((165, 165)).circular_thumbnail()
+
+    im = Render.new((934, 282), Color.PRETTY_BLACK)
+    im.text(m.nickname, 'center', (-120, 15), ('lato-medium.ttf', 32))
+    im.paste(icon, 'left', (50, 0))
+
+    await bot.send(files=await im.render())
+    ```
+    """
+
+    def __init__(
+        self,
+        img:      bytes | str | None = None,
+        optimize: bool               = False
+    ) -> None:
+        """
+        #### img
+        Bytes or path of the image
+
+        #### optimize
+        Joins the resizes and crops before running them, see MakeImage.lazy
+        """
+
+        self.source:   Tuple[str, tuple]              = ('open', (img,))
+        self.ops:      list[Tuple[str, tuple, dict]]  = []
+        self.optimize: bool                           = optimize
+
+    @classmethod
+    def new(
+        cls,
+        size:  Size,
+        color: RGBA | Color = Color.WHITE
+    ) -> Render:
+        render = cls()
+        render.source = ('new', (size, color))
+        return render
+
+    @classmethod
+    def progress_bar(
+        cls,
+        size:     Size,
+        radius:   int          = 30,
+        color:    RGBA | Color = Color.WHITE,
+        bg_color: RGBA | Color = Color.PRETTY_BLACK
+    ) -> Render:
+        render = cls()
+        render.source = ('progress_bar', (size, radius, color, bg_color))
+        return render
+
+    def __getattr__(self, name: str):
+        # Ignore private names, pickle looks for some of them before __init__ is called
+        if name.startswith('_'):
+            raise AttributeError(name)
+
+        cls = ProgressBar if self.source[0] == 'progress_bar' else MakeImage
+        if not callable(getattr(cls, name, None)):
+            raise AttributeError(name)
+
+        def foo(*args, **kwargs) -> Render:
+            self.ops.append((name, args, kwargs))
+            return self
+        return foo
+
+    def make(self) -> MakeImage:
+        """
+        Runs the operations in the current process and returns the image
+        """
+
+        ops = _optimize(self.ops) if self.optimize else self.ops
+        return self.apply(self._open(ops), ops)
+
+    @property
+    def bytes(self) -> bytes:
+        return self.make().bytes
+
+    def save(
+        self,
+        path:    str,
+        format:  str        = 'webp',
+        quality: int | None = None
+    ) -> None:
+        self.make().save(path, format, quality)
+
+    def apply(
+        self,
+        img: MakeImage,
+        ops: list[Tuple[str, tuple, dict]] | None = None
+    ) -> MakeImage:
+        """
+        Runs the operations (or only ops) on img, in the current process, and returns the resulting image
+        """
+
+        for name, args, kwargs in self.ops if ops is None else ops:
+            args = [i.make() if isinstance(i, Render) else i for i in args]
+            # Methods like to_img return a new image instead of changing the actual one
+            if isinstance(ret := getattr(img, name)(*args, **kwargs), MakeImage):
+                img = ret
+        return img
+
+    async def render(
+        self,
+        format:  str        = 'webp',
+        quality: int | None = None
+    ) -> bytes:
+        """
+        Makes the image in the process pool of EXECUTOR and returns its bytes
+        """
+
+        return await EXECUTOR.process(_render, self, format, quality)
+
+    def _open(self, ops: list[Tuple[str, tuple, dict]] = []) -> MakeImage:
+        kind, args = self.source
+        if kind == 'new':
+            return MakeImage.new(*args)
+        if kind == 'progress_bar':
+            return ProgressBar(*args)
+
+        img = MakeImage(args[0]) if isinstance(args[0], bytes) else MakeImage.from_path(args[0])
+
+        # If the image will be reduced, a jpeg can be decoded directly in 1/2, 1/4 or 1/8 of the size
+        if ops and ops[0][0] == '_resize_box' and img.img.format == 'JPEG':
+            (w, h), (x0, y0, x1, y1) = ops[0][1]
+            img.img.draft(img.img.mode, (ceil(w / (x1-x0)), ceil(h / (y1-y0))))
+        return img
+
+
+class Field:
+    """
+    A value of a Template that changes on each Template.make
+    """
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+
+
+class Template(Render):
+    """
+    A Render where some values are Fields, given only when the image is made
+
+    The operations before the first one that uses a Field are made only once,
+    each Template.make only copies this image and runs the other operations,
+    so put everything that doesn't change (background, frames, labels) first
+
+    ```
+    card = Template.new((934, 282), Color.PRETTY_BLACK)
+    card.text('RANK', 'center', (135, -45), ('lato-light.ttf', 24))
+    card.text('LEVEL', 'center', (300, -46), ('lato-light.ttf', 26), Color.CYAN)
+    card.text(Field('nickname'), 'center', (-120, 15), ('lato-medium.ttf', 32))
+    card.paste(Field('icon'), 'left', (50, 0))
+
+    @bot.add()
+    async def rank(m: Msg):
+        icon = Render(await File.get(m.icon)).resize((165, 165)).circular_thumbnail()
+        await bot.send(files=await card.render(nickname=m.nickname, icon=icon))
+    ```
+    """
+
+    def __init__(self, img: bytes | str | None = None) -> None:
+        super().__init__(img)
+        # Identifies the cached base image of the template, including in other processes
+        self.id = uuid4().hex
+
+    def make(self, **fields: Any) -> MakeImage:
+        """
+        Makes the image in the current process, with the values of the Fields
+        """
+
+        def has_field(op) -> bool:
+            _, args, kwargs = op
+            return any(isinstance(i, Field) for i in (*args, *kwargs.values()))
+
+        def value(i: Any) -> Any:
+            return fields[i.name] if isinstance(i, Field) else i
+
+        n = next((i for i, op in enumerate(self.ops) if has_field(op)), len(self.ops))
+
+        key = (self.id, len(self.ops))
+        if key in _bases:
+            _bases.move_to_end(key)
+        else:
+            _bases[key] = self.apply(self._open(), self.ops[:n])
+            if len(_bases) > 32:
+                _bases.popitem(last=False)
+
+        img = copy(_bases[key])
+        img.img = img.img.copy()
+
+        return self.apply(img, [
+            (name, [value(i) for i in args], {k: value(v) for k, v in kwargs.items()})
+            for name, args, kwargs in self.ops[n:]
+        ])
+
+    async def render(
+        self,
+        format:   str        = 'webp',
+        quality:  int | None = None,
+        **fields: Any
+    ) -> bytes:
+        """
+        Makes the image in the process pool of EXECUTOR, with the values of the Fields, and returns its bytes
+        """
+
+        return await EXECUTOR.process(_render, self, format, quality, fields)
+
+
+def _optimize(ops: list[Tuple[str, tuple, dict]]) -> list[Tuple[str, tuple, dict]]:
+    """
+    Joins resizes, and crops after a resize, in a single MakeImage._resize_box
+
+    The result is the same image, but only the pixels that will be used are resized
+    """
+
+    optimized = []
+    for name, args, kwargs in ops:
+        if name == 'resize' and not (args[1:] or [kwargs.get('preserve_aspect')])[0]:
+            name, args, kwargs = '_resize_box', (tuple(args[0] if args else kwargs['size']), (0, 0, 1, 1)), {}
+
+        if optimized and optimized[-1][0] == '_resize_box':
+            (W, H), (x0, y0, x1, y1) = optimized[-1][1]
+            bw, bh = x1 - x0, y1 - y0
+
+            if name == '_resize_box':
+                size, (u0, v0, u1, v1) = args
+                optimized[-1] = ('_resize_box', (size, (x0 + u0*bw, y0 + v0*bh, x0 + u1*bw, y0 + v1*bh)), {})
+                continue
+
+            if name == 'crop':
+                w, h = args[0] if args else kwargs['size']
+                # Same box as MakeImage.crop
+                left, top = W//2 - w//2, H//2 - h//2
+                right, bottom = W//2 + w//2, H//2 + h//2
+
+                # Crops bigger than the image fill the outside with transparency, which a resize can't do
+                if left >= 0 and top >= 0 and right <= W and bottom <= H and right > left and bottom > top:
+                    box = (x0 + left/W*bw, y0 + top/H*bh, x0 + right/W*bw, y0 + bottom/H*bh)
+                    optimized[-1] = ('_resize_box', ((right-left, bottom-top), box), {})
+                    continue
+
+        optimized.append((name, args, kwargs))
+    return optimized
+
+class Grid:
+    """
+    Makes an image with many icons side by side, like the top 10 of a leaderboard
+
+    The icons are downloaded at the same time (at most concurrency at once),
+    made in the threads of EXECUTOR and pasted in a single image
+
+    Made icons are cached by link, so the icons of the same users aren't made again
+
+    ```
+    grid = Grid(columns=1, cell=(80, 80), gap=10, color=Color.PRETTY_BLACK)
+    im = await grid.make([u.icon for u in top])
+
+    for i, u in enumerate(top):
+        x, y = grid.position(i)
+        im.text(u.nickname, move=(x + 100, y + 25), font=('lato-medium.ttf', 26))
+    ```
+
+    #### circular
+    Makes the icons circular thumbnails
+
+    #### border
+    (size, color) of the border of each icon
+    """
+
+    def __init__(
+        self,
+        columns:     int,
+        cell:        Size                    = (100, 100),
+        gap:         int                     = 0,
+        color:       RGBA | Color            = Color.TRANSPARENT,
+        circular:    bool                    = True,
+        border:      Tuple[int, RGBA] | None = None,
+        concurrency: int                     = 8
+    ) -> None:
+        self.columns     = columns
+        self.cell        = cell
+        self.gap         = gap
+        self.color       = color
+        self.circular    = circular
+        self.border      = border
+        self.concurrency = concurrency
+
+    def position(self, n: int) -> Size:
+        """
+        Returns the position of the top left corner of the cell n
+        """
+
+        w, h = self.cell
+        row, column = divmod(n, self.columns)
+        return self.gap + column*(w + self.gap), self.gap + row*(h + self.gap)
+
+    async def make(self, icons: list[str | bytes]) -> MakeImage:
+        """
+        Returns an image with the icons (links, paths or bytes) in the order of the list
+
+        Icons that can't be decoded (broken or too large) leave their cell empty
+        """
+
+        semaphore = Semaphore(self.concurrency)
+
+        async def foo(icon: str | bytes) -> Image.Image | None:
+            key = (sha1(icon).digest() if isinstance(icon, bytes) else icon, self.cell, self.circular, self.border)
+            if key in _icons:
+                _icons.move_to_end(key)
+                return _icons[key]
+
+            async with semaphore:
+                b = await File.get(icon)
+            try:
+                im = await EXECUTOR.thread(_icon, b, self.cell, self.circular, self.border)
+            except (OSError, ValueError, ImageTooLarge):
+                # One bad avatar must not fail the whole image
+                return None
+
+            _icons[key] = im
+            if len(_icons) > 512:
+                _icons.popitem(last=False)
+            return im
+
+        ims = await gather(*[foo(i) for i in icons])
+
+        rows = -(-len(ims) // self.columns)
+        w, h = self.cell
+        img = Image.new(
+            'RGBA',
+            (self.columns*(w + self.gap) + self.gap, rows*(h + self.gap) + self.gap),
+            self.color
+        )
+        for n, im in enumerate(ims):
+            if im:
+                img.paste(im, self.position(n), im)
+        return MakeImage(img)
+
+
+def _icon(
+    b:        bytes,
+    cell:     Size,
+    circular: bool,
+    border:   Tuple[int, RGBA] | None
+) -> Image.Image:
+    """
+    Makes an icon of Grid
+    """
+
+    size = (cell[0] - border[0]*2, cell[1] - border[0]*2) if border else cell
+    img = MakeImage.decode(b, size)
+    img = MakeImage(ImageOps.fit(img.img.convert('RGBA'), size, Image.BICUBIC))
 
-        bg_fill = self.img.copy()
-        bg = self.img.copy()
+    if circular:
+        img.circular_thumbnail()
+    if border:
+        img.add_border(*border)
+    return img.img
 
-        pixdata = bg_fill.load()
+# Icons made by Grid.make
+_icons: OrderedDict[tuple, Image.Image] = OrderedDict()
 
-        for y in range(bg_fill.size[1]):
-            for x in range(bg_fill.size[0]):
-                if pixdata[x, y] == self.bg:
-                    pixdata[x, y] = self.color
+# Base images of the Templates, see Template.make
+_bases: OrderedDict[Tuple[str, int], MakeImage] = OrderedDict()
 
-        bg_fill = bg_fill.crop((0, 0, px*2, h))
-        bg.paste(bg_fill, mask=bg_fill)
-        self.img = bg.resize((w, h), Image.BICUBIC)
+def _render(
+    render:  Render,
+    format:  str,
+    quality: int | None,
+    fields:  dict[str, Any] = {}
+) -> bytes:
+    arr = BytesIO()
+    render.make(**fields).save(arr, format, quality)
+    return arr.getvalue()
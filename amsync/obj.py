@@ -2,22 +2,24 @@ from __future__ import annotations
 
 from uuid import uuid4
 from typing import (
+    TYPE_CHECKING,
     Any,
     Callable,
     Literal,
     NoReturn,
     Dict
 )
+from hashlib import sha1
 from pathlib import Path
 from asyncio import gather
 
 from ujson import dumps, dump, load
-from aiohttp import request
-from filetype import guess_mime
-from pybase64 import b64encode
 
+from .cache import DownloadCache
+from .executor import EXECUTOR
 from .enum import MediaType
 from .utils import (
+    lazy_import,
     get_value,
     words,
     on_limit,
@@ -40,6 +42,9 @@ from .exceptions import (
     AminoSays
 )
 
+if TYPE_CHECKING:
+    from .db import AsyncDB
+
 __all__ = [
     'Req',
     'User',
@@ -49,6 +54,11 @@ __all__ = [
     'My'
 ]
 
+# Imported on first use, so "import amsync" stays fast
+aiohttp  = lazy_import('aiohttp')
+filetype = lazy_import('filetype')
+pybase64 = lazy_import('pybase64')
+
 ignore_codes = [
     1628 # Sorry, you cannot pick this member.. | Chat.config
 ]
@@ -58,6 +68,9 @@ actual_chat: str | None = None
 bot_id:      str | None = None
 API = 'https://service.narvii.com/api/v1/'
 
+# Used by File.get to cache downloaded links
+downloads = DownloadCache()
+
 
 class Req:
     async def new(
@@ -71,7 +84,7 @@ class Req:
         **kwargs are the extra arguments of aiohttp.request
         """
 
-        async with request(
+        async with aiohttp.request(
             method  = method,
             url     = url,
             **kwargs
@@ -107,53 +120,64 @@ async def _req(
     return res
 
 
-async def upload_media(file: str) -> str:
+def _media_key(b: bytes) -> str:
+    return sha1(b).hexdigest()
+
+async def _upload(target: str, file: str | bytes) -> str:
+    """
+    Send a file to target and returns the file link
+
+    Uploads are cached by the content of the file and the target,
+    so sending the same file again returns the same link without uploading it
+
+    Links are also cached by the link itself, so a link that was already
+    uploaded (or returned by an upload) isn't downloaded again
+    """
+
+    # Keys that don't have the link yet, only these are saved
+    keys = []
+    if File.type(file) == MediaType.LINK:
+        keys.append(_media_key(file.encode()))
+        if link := await _media_db().get_media(keys[0], target):
+            return link
+
+    b = await File.get(file)
+    key = _media_key(b)
+    if link := await _media_db().get_media(key, target):
+        if keys:
+            await _media_db().add_media(keys, target, link)
+        return link
+
+    link = (await _req('post', target, b, False)).json['mediaValue']
+    await _media_db().add_media([*keys, key, _media_key(link.encode())], target, link)
+    return link
+
+async def upload_media(file: str | bytes) -> str:
     """
     Send a file to be used when posting a blog
 
     Returns the file link
     """
 
-    return (
-        await _req(
-            'post',
-            '/g/s/media/upload',
-            await File.get(file),
-            False,
-        )
-    ).json['mediaValue']
+    return await _upload('g/s/media/upload', file)
 
-async def upload_chat_bg(file: str) -> str:
+async def upload_chat_bg(file: str | bytes) -> str:
     """
     Send a file to be used as chat background
 
     Returns the file link
     """
 
-    return (
-        await _req(
-            'post',
-            'g/s/media/upload/target/chat-background',
-            await File.get(file),
-            False,
-        )
-    ).json['mediaValue']
+    return await _upload('g/s/media/upload/target/chat-background', file)
 
-async def upload_chat_icon(file: str) -> str:
+async def upload_chat_icon(file: str | bytes) -> str:
     """
     Send a file to be used as chat icon
 
     Returns the file link
     """
 
-    return (
-        await _req(
-            'post',
-            'g/s/media/upload/target/chat-cover',
-            await File.get(file),
-            False,
-        )
-    ).json['mediaValue']
+    return await _upload('g/s/media/upload/target/chat-cover', file)
 
 
 class Message:
@@ -211,8 +235,8 @@ class Message:
             Creates the data for sending a embed
             """
 
-            if embed.image:
-                embed.image = [[100, await upload_media(embed.image), None]]
+            # Don't overwrite embed.image, so the same Embed can be sent again
+            image = [[100, await upload_media(embed.image), None]] if embed.image else None
             return [
                 {
                     'content': embed.msg_text,
@@ -220,7 +244,7 @@ class Message:
                         'link':      embed.link,
                         'title':     embed.title,
                         'content':   embed.text,
-                        'mediaList': embed.image,
+                        'mediaList': image,
                     },
                 }
             ]
@@ -335,17 +359,27 @@ class File:
 
         return MediaType.PATH
 
-    async def get(file: str | bytes) -> bytes:
+    async def get(
+        file:  str | bytes,
+        cache: bool = True
+    ) -> bytes:
         """
         Returns the bytes of a file
 
         If the file is a link, download the file
+
+        #### cache
+        If the link is downloaded through obj.downloads,
+        which keeps the file and only downloads it again if it changed
         """
 
         type = File.type(file)
 
         if type == MediaType.LINK:
-            async with request('get', file) as res:
+            if cache:
+                return await downloads.get(file)
+
+            async with aiohttp.request('get', file) as res:
                 return await res.read()
 
         if type == MediaType.BYTES:
@@ -359,7 +393,7 @@ class File:
         Convert bytes to base64
         """
 
-        return b64encode(file_bytes).decode()
+        return pybase64.b64encode(file_bytes).decode()
 
     async def process(file: str | bytes) -> dict[str, Any] | NoReturn:
         """
@@ -373,8 +407,10 @@ class File:
             raise FileNotFoundError(file)
 
         b = await File.get(file)
-        b64 = File.b64(b)
-        type = (guess_mime(b) or 'audio/mp3').split('/')
+        b64 = await EXECUTOR.run(File.b64, b, nbytes=len(b))
+
+        # Only first 261 bytes representing the max file header is required
+        type = (filetype.guess_mime(b[:261]) or 'audio/mp3').split('/')
 
         if type[-1] == 'gif':
                 return {
@@ -975,3 +1011,13 @@ class My:
 # # # # # # #
 
 MESSAGE = Message()
+
+_db: AsyncDB | None = None
+def _media_db() -> AsyncDB:
+    global _db
+
+    if not _db:
+        # peewee is only imported when the first file is uploaded
+        from .db import AsyncDB
+        _db = AsyncDB()
+    return _db
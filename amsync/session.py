@@ -0,0 +1,159 @@
+from __future__ import annotations
+
+from re import search
+from time import time
+from typing import Callable
+from asyncio import Task, TimerHandle, get_running_loop
+from binascii import Error
+
+from . import obj
+from .obj import _req
+from .utils import lazy_import
+
+pybase64 = lazy_import('pybase64')
+
+_1_DAY = 86400
+
+
+class Session:
+    """
+    Keeps the sid of the account valid
+
+    The sid is decoded once, and a new one is requested in the background
+    refresh_before seconds before it expires, so reconnects never wait for a login
+
+    #### lifetime
+    Seconds a sid is used after the login
+
+    #### refresh_before
+    Seconds before the expiration that a new sid is requested
+
+    #### on_refresh
+    Called with the session after each new sid
+    """
+
+    def __init__(
+        self,
+        email:          str,
+        password:       str,
+        deviceid:       str,
+        lifetime:       int                               = _1_DAY,
+        refresh_before: int                               = 3600,
+        on_refresh:     Callable[[Session], None] | None = None
+    ):
+        self.email          = email
+        self.password       = password
+        self.deviceid       = deviceid
+        self.lifetime       = lifetime
+        self.refresh_before = refresh_before
+        self.on_refresh     = on_refresh
+
+        self.sid:     str | None = None
+        self.uid:     str | None = None
+        self.expires: float      = 0
+
+        # peewee is only imported when the bot starts
+        from .db import AsyncDB
+        self._db:         AsyncDB             = AsyncDB()
+        self._timer:      TimerHandle | None  = None
+        self._refresh:    Task | None         = None
+        self._background: Task | None         = None
+
+    @property
+    def valid(self) -> bool:
+        return self.sid is not None and time() < self.expires
+
+    async def start(self) -> Session:
+        """
+        Uses the saved sid if it's still valid, otherwise logs in
+
+        Only waits for the login when there is no valid sid
+        """
+
+        if self.valid:
+            return self
+
+        if saved := await self._db.get_session(self.email):
+            self._use(*saved)
+        if not self.valid:
+            await self.refresh()
+        else:
+            self._schedule()
+        return self
+
+    async def refresh(self) -> None:
+        """
+        Logs in again, concurrent calls share the same login
+        """
+
+        if not self._refresh or self._refresh.done():
+            self._refresh = get_running_loop().create_task(self._login())
+        await self._refresh
+
+    def stop(self) -> None:
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+
+    async def _login(self) -> None:
+        sid = (await _req('post', 'g/s/auth/login', data={
+            'email':    self.email,
+            'secret':  f'0 {self.password}',
+            'deviceID': self.deviceid,
+        })).json['sid']
+
+        created = int(time())
+        await self._db.add_account(self.email, sid, created)
+        self._use(sid, created)
+        self._schedule()
+
+        if self.on_refresh:
+            self.on_refresh(self)
+
+    def _use(self, sid: str, created: int) -> None:
+        self.uid, signed = _decode(sid)
+        self.sid = sid
+        # The time inside the sid is only trusted if it's close to the login
+        if not signed or abs(signed - created) > self.lifetime:
+            signed = created
+        self.expires = signed + self.lifetime
+        obj.headers['NDCAUTH'] = f'sid={sid}'
+        obj.bot_id = self.uid
+
+    def _schedule(self, delay: float | None = None) -> None:
+        self.stop()
+        if delay is None:
+            delay = max(self.expires - self.refresh_before - time(), 0)
+
+        self._timer = get_running_loop().call_later(delay, self._start_background_refresh)
+
+    def _start_background_refresh(self) -> None:
+        # The reference keeps the task from being garbage collected while it runs
+        self._background = get_running_loop().create_task(self._background_refresh())
+
+    async def _background_refresh(self) -> None:
+        try:
+            await self.refresh()
+        except Exception:
+            # The current sid may still be valid, so try again later
+            self._schedule(60)
+
+
+def _decode(sid: str) -> tuple[str | None, int | None]:
+    """
+    Returns the uid of the sid and when it was signed
+    """
+
+    while True:
+        try:
+            decoded = pybase64.urlsafe_b64decode(sid).decode('cp437')
+            break
+        except Error:
+            sid = sid[:-1]
+
+    uid = search(r'\w{8}-\w{4}-\w{4}-\w{4}-\w{12}', decoded)
+    signed = search(r'"5":\s*(\d+)', decoded)
+    return (
+        uid.group() if uid else None,
+        int(signed.group(1)) if signed else None
+    )
@@ -1,10 +1,14 @@
 from __future__ import annotations
 
+import sys
+from types import ModuleType
 from dis import Bytecode
 from typing import Dict, Any, List, Tuple
+from datetime import datetime, timezone
 from platform import system
 from subprocess import run
 from contextlib import suppress
+from importlib.util import find_spec, module_from_spec, LazyLoader
 from unicodedata import normalize
 
 
@@ -28,9 +32,35 @@ class Slots(metaclass=MetaSlots):
     Adds the existing __slots__, class attributes and the instance attributes (self.x) in __init__, to the subclass
     """
 
+def lazy_import(name: str) -> ModuleType:
+    """
+    Returns the module without importing it, it's imported on the first use of one of its attributes
+
+    ```
+    aiohttp = lazy_import('aiohttp')
+    ```
+    """
+
+    if name in sys.modules:
+        return sys.modules[name]
+
+    spec = find_spec(name)
+    spec.loader = LazyLoader(spec.loader)
+    module = module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
 in_win = system() == 'Windows'
 def clear() -> None:
-    run('cls' if in_win else 'clear', shell=True)
+    # Without a terminal (containers, logs to a file) there is nothing to clear
+    if not sys.stdout.isatty():
+        return
+    if in_win:
+        run('cls', shell=True)
+    else:
+        # The same that "clear" prints, without starting a process
+        print('\033[H\033[2J\033[3J', end='', flush=True)
 
 def words(s):
     return s.strip().count(' ')+1
@@ -50,6 +80,13 @@ def get_value(
             return convert(tmp)
         return tmp
 
+def to_timestamp(s: str) -> int:
+    """
+    Converts the amino dates ("2021-08-10T19:33:33Z") to unix time
+    """
+
+    return int(datetime.strptime(s, '%Y-%m-%dT%H:%M:%SZ').replace(tzinfo=timezone.utc).timestamp())
+
 def fix_ascii(s: str) -> str:
     return normalize('NFKD', s).encode('ASCII', 'ignore').decode().strip()
 
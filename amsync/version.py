@@ -0,0 +1,10 @@
+# Read by setup.py, and by Bot.check_update without opening any file
+
+# Production
+PRODUCTION = 'p0.0.53'
+
+# Test
+TEST = 't0.0.55'
+
+__version__ = TEST
+version     = PRODUCTION[1:]
@@ -1,23 +1,22 @@
 from __future__ import annotations
 
-from re import search
+from time import perf_counter
 from typing import AsyncIterator, Literal
 from asyncio import AbstractEventLoop, Future, sleep
-from binascii import Error
 from contextlib import suppress
 
 from ujson import loads
-from aiohttp import ClientSession, WSServerHandshakeError
 from colorama import Fore
-from pybase64 import urlsafe_b64decode
 
 from . import obj
-from .db import _DB
-from .obj import Message, _req
+from .obj import Message
+from .session import Session
 from .enum import WsStatus
-from .utils import Slots, clear
+from .utils import Slots, clear, lazy_import
 from .dataclass import Msg
 
+aiohttp = lazy_import('aiohttp')
+
 
 class Ws(Slots):
     __slots__ = [
@@ -31,11 +30,13 @@ class Ws(Slots):
         email:        'Bot.email',             # type: ignore
         password:     'Bot.password',          # type: ignore
         only_chats:   'Bot.only_chats'   = {}, # type: ignore
-        ignore_chats: 'Bot.ignore_chats' = {}  # type: ignore
+        ignore_chats: 'Bot.ignore_chats' = {}, # type: ignore
+        archive:      'Bot.archive'      = None, # type: ignore
+        started:      float | None       = None
     ):
         self._deviceid: str               = obj.headers['NDCDEVICEID']
         self._loop:     AbstractEventLoop = loop
-        self._db:       _DB               = _DB()
+        self._session:  Session | None    = None
         self.futures:   list[Future]      = []
         self._msg = Message()
 
@@ -43,26 +44,18 @@ class Ws(Slots):
         self._password     = password
         self._only_chats   = only_chats
         self._ignore_chats = ignore_chats
+        self._archive      = archive
         self._status       = WsStatus.OPEN
+        self._started      = started or perf_counter()
+        self.ready_in:     float | None = None
 
 
-    async def _get_sid(self) -> str:
-        """
-        Get the account sid
-        """
-
-        return (await _req('post', 'g/s/auth/login', data={
-            'email':    self._email,
-            'secret':  f'0 {self._password}',
-            'deviceID': self._deviceid,
-        })).json['sid']
-
     async def _connect(self) -> AsyncIterator[Msg]:
         """
         Connect the websocket
         """
 
-        async with ClientSession() as session:
+        async with aiohttp.ClientSession() as session:
             while True:
                 try:
                     ws = await session.ws_connect(
@@ -70,7 +63,7 @@ class Ws(Slots):
                         headers=obj.headers,
                     )
                     break
-                except WSServerHandshakeError as e:
+                except aiohttp.WSServerHandshakeError as e:
                     if str(e)[0] == '5':
                         clear()
                         for i in range(5):
@@ -83,6 +76,8 @@ class Ws(Slots):
                         raise
 
             clear()
+            if self.ready_in is None:
+                self.ready_in = perf_counter() - self._started
             self._call_events('ready')
 
             while self._status == WsStatus.OPEN: # for tests
@@ -139,23 +134,14 @@ class Ws(Slots):
         Start the bot
         """
     
-        if not self._db.get_account(self._email):
-            self._db.add_account(self._email, await self._get_sid())
-
-        sid = self._db.get_account(self._email)
+        def update_bot(session: Session) -> None:
+            bot.sid = session.sid
+            bot.id = session.uid
 
-        obj.headers['NDCAUTH'] = f'sid={sid}'
-        while True:
-            try:
-                decoded = urlsafe_b64decode(sid).decode('cp437')
-                break
-            except Error:
-                sid = sid[:-1]
-        id_ = search(r'\w{8}-\w{4}-\w{4}-\w{4}-\w{12}', decoded).group()
-
-        bot.sid = sid
-        bot.id = id_
-        obj.bot_id = id_
+        # The session is only created once, reconnects reuse its sid
+        if not self._session:
+            self._session = Session(self._email, self._password, self._deviceid, on_refresh=update_bot)
+        update_bot(await self._session.start())
 
         self._events = events
         events = {
@@ -168,9 +154,12 @@ class Ws(Slots):
 
         async for m in self._connect():
             if m == WsStatus.CLOSED:
-                # Reconnect
+                # Reconnect, without logging in again
                 return await self.run(call, self._events, bot)
 
+            if self._archive:
+                self._archive.add(m)
+
             if self._can_call(m):
                 with suppress(KeyError):
                     self._call_events(events[f'{m.type}:{m.media_type}'], m)
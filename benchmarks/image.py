@@ -0,0 +1,307 @@
+"""
+Benchmarks of amsync.image
+
+Each case runs in its own process, measuring the latency (median of many runs),
+the peak memory used by the case and the size of the output
+
+    python benchmarks/image.py                          # run all cases
+    python benchmarks/image.py -k encode                # only cases with "encode" in the name
+    python benchmarks/image.py --save baseline.json     # save the results
+    python benchmarks/image.py --compare baseline.json  # compare with saved results
+
+With --compare, cases that got slower, bigger or used more memory than --threshold
+are shown as regressions and the exit code is 1
+"""
+
+from __future__ import annotations
+
+import sys
+from io import BytesIO
+from time import perf_counter
+from typing import Any, Callable, Dict, Tuple
+from pathlib import Path
+from argparse import ArgumentParser
+from statistics import median
+from multiprocessing import get_context
+
+from ujson import dump, load
+
+# Benchmark the amsync of this repository, not the installed one
+sys.path.insert(0, str(Path(__file__).absolute().parent.parent))
+
+from PIL import Image, ImageDraw
+
+from amsync import MakeImage, ProgressBar, Color
+from amsync import image
+
+try:
+    from resource import getrusage, RUSAGE_SELF
+except ImportError: # Windows
+    getrusage = None
+
+SIZES = [256, 1024, 2048]
+
+
+# # # # # # # #
+#   Fixtures  #
+# # # # # # # #
+
+def photo(size: int) -> Image.Image:
+    """
+    An image with many colors, similar to a photo
+    """
+
+    img = Image.radial_gradient('L').resize((size, size)).convert('RGB')
+    noise = Image.effect_noise((size, size), 40).convert('RGB')
+    return Image.blend(img, noise, 0.3).rotate(15).convert('RGBA')
+
+def card(size: int) -> Image.Image:
+    """
+    An image with few colors, similar to a rank card
+    """
+
+    img = Image.new('RGBA', (size, size // 3), Color.PRETTY_BLACK)
+    draw = ImageDraw.Draw(img)
+    draw.rounded_rectangle((size // 10, size // 12, size - size // 10, size // 5), size // 30, Color.GRAY)
+    draw.ellipse((10, 10, size // 4, size // 4), Color.CYAN)
+    return img
+
+def encoded(img: Image.Image, format: str) -> bytes:
+    arr = BytesIO()
+    img.convert('RGB' if format == 'jpeg' else img.mode).save(arr, format)
+    return arr.getvalue()
+
+
+# # # # # # #
+#   Cases   #
+# # # # # # #
+
+def text(font: str | None) -> Callable[[], None]:
+    im = MakeImage(card(1024))
+    font = (font, 32) if font else None
+
+    def foo():
+        for i in range(10):
+            im.text(f'#{i} nickname {i * 100} XP', 'top', (0, i * 30), font)
+    return foo
+
+def paste(size: int) -> Callable[[], None]:
+    im = MakeImage(card(size))
+    icon = MakeImage(photo(size // 4))
+    return lambda: im.paste(icon, 'center')
+
+def circular_thumbnail(size: int) -> Callable[[], None]:
+    img = photo(size)
+    return lambda: MakeImage(img.copy()).circular_thumbnail()
+
+def add_border(size: int) -> Callable[[], None]:
+    im = MakeImage(photo(size))
+    im.circular_thumbnail()
+    img = im.img
+    return lambda: MakeImage(img.copy()).add_border(4, Color.BLACK)
+
+def progress_bar(size: int) -> Callable[[], None]:
+    def foo():
+        ProgressBar((size, size // 10), size // 20, Color.CYAN, Color.GRAY).fill(size // 4)
+    return foo
+
+def encode(
+    fixture: Callable[[int], Image.Image],
+    size:    int,
+    format:  str
+) -> Callable[[], bytes]:
+    img = fixture(size)
+    # jpeg has no transparency
+    im = MakeImage(img.convert('RGB') if format == 'jpeg' else img)
+
+    def foo():
+        arr = BytesIO()
+        im.save(arr, format)
+        return arr.getvalue()
+    return foo
+
+def decode(size: int) -> Callable[[], None]:
+    b = encoded(photo(size), 'jpeg')
+    return lambda: MakeImage.decode(b, (165, 165))
+
+def cases(font: str | None) -> Dict[str, Tuple[Callable, tuple, bool]]:
+    """
+    Returns the name of each case, the function that creates it, its arguments
+    and whether the caches of amsync.image are cleared before each run
+
+    The cases are created inside the process that runs them
+
+    The cases that repeat the same inputs only measure the caches after the first run,
+    so they also have a -cold version, which measures the real drawing
+    """
+
+    all_cases = {
+        'text':      (text, (font,), False),
+        'text-cold': (text, (font,), True)
+    }
+    for size in SIZES:
+        all_cases[f'paste-{size}']                   = (paste, (size,), False)
+        all_cases[f'circular_thumbnail-{size}']      = (circular_thumbnail, (size,), False)
+        all_cases[f'circular_thumbnail-cold-{size}'] = (circular_thumbnail, (size,), True)
+        all_cases[f'add_border-{size}']              = (add_border, (size,), False)
+        all_cases[f'add_border-cold-{size}']         = (add_border, (size,), True)
+        all_cases[f'progress_bar-{size}']            = (progress_bar, (size,), False)
+        all_cases[f'progress_bar-cold-{size}']       = (progress_bar, (size,), True)
+        all_cases[f'decode-jpeg-{size}']             = (decode, (size,), False)
+        for format in ('webp', 'png', 'jpeg'):
+            all_cases[f'encode-{format}-photo-{size}'] = (encode, (photo, size, format), False)
+            all_cases[f'encode-{format}-card-{size}']  = (encode, (card, size, format), False)
+    return all_cases
+
+
+# # # # # # #
+#   Runner  #
+# # # # # # #
+
+def _peak_memory() -> int | None:
+    """
+    Peak memory of the process in bytes
+    """
+
+    if not getrusage:
+        return None
+    peak = getrusage(RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+def _clear_caches() -> None:
+    """
+    Clears the caches of the drawing of amsync.image, the fonts stay loaded
+    """
+
+    image._text_size.cache_clear()
+    image._text_masks.cache_clear()
+    image._circle_mask.cache_clear()
+    image._progress_bar.cache_clear()
+    image._borders.clear()
+
+def _run(
+    make:     Callable,
+    args:     tuple,
+    cold:     bool,
+    min_time: float,
+    min_runs: int
+) -> Dict[str, Any]:
+    case = make(*args)
+    before = _peak_memory()
+
+    times = []
+    out = None
+    start = perf_counter()
+    while len(times) < min_runs or perf_counter() - start < min_time:
+        if cold:
+            _clear_caches()
+        t = perf_counter()
+        out = case()
+        times.append(perf_counter() - t)
+
+    after = _peak_memory()
+    return {
+        'median':      median(times),
+        'min':         min(times),
+        'runs':        len(times),
+        'peak_memory': after - before if before is not None else None,
+        'bytes':       len(out) if isinstance(out, bytes) else None
+    }
+
+def run(
+    names:    list[str],
+    font:     str | None,
+    min_time: float,
+    min_runs: int
+) -> Dict[str, Dict[str, Any]]:
+    all_cases = cases(font)
+    results = {}
+
+    # A new process for each case, so the peak memory of one case doesn't hide the others
+    ctx = get_context('spawn')
+    for name in names:
+        make, args, cold = all_cases[name]
+        with ctx.Pool(1) as pool:
+            results[name] = pool.apply(_run, (make, args, cold, min_time, min_runs))
+        show(name, results[name])
+    return results
+
+def show(
+    name:   str,
+    result: Dict[str, Any],
+    old:    Dict[str, Any] | None = None
+) -> None:
+    line = f"{name:<28} {result['median'] * 1000:9.3f} ms"
+    if old:
+        line += f" ({(result['median'] / old['median'] - 1) * 100:+6.1f}%)"
+    if result['peak_memory'] is not None:
+        line += f"  {result['peak_memory'] / 1024 / 1024:7.1f} MB"
+    if result['bytes'] is not None:
+        line += f"  {result['bytes']:>9} B"
+    print(line)
+
+def compare(
+    results:   Dict[str, Dict[str, Any]],
+    baseline:  Dict[str, Dict[str, Any]],
+    threshold: float
+) -> list[str]:
+    """
+    Returns the regressions of results in relation to the baseline
+    """
+
+    regressions = []
+    for name, result in results.items():
+        if not (old := baseline.get(name)):
+            continue
+
+        if result['median'] > old['median'] * (1 + threshold):
+            regressions.append(f"{name}: {old['median'] * 1000:.3f} ms -> {result['median'] * 1000:.3f} ms")
+
+        for key, unit in (('bytes', 'B'), ('peak_memory', 'B')):
+            # Small memory changes are noise of the allocator
+            if (
+                result[key] is not None
+                and old.get(key) is not None
+                and result[key] > old[key] * (1 + threshold)
+                and (key != 'peak_memory' or result[key] - old[key] > 1024 * 1024)
+            ):
+                regressions.append(f'{name}: {key} {old[key]} {unit} -> {result[key]} {unit}')
+    return regressions
+
+def main() -> None:
+    parser = ArgumentParser(description='Benchmarks of amsync.image')
+    parser.add_argument('-k', dest='filter', default='', help='only run cases with this text in the name')
+    parser.add_argument('--font', help='.ttf used in the text case, by default the Pillow font')
+    parser.add_argument('--min-time', type=float, default=0.5, help='minimum seconds running each case')
+    parser.add_argument('--min-runs', type=int, default=5, help='minimum runs of each case')
+    parser.add_argument('--save', help='save the results in this .json')
+    parser.add_argument('--compare', help='compare the results with this .json')
+    parser.add_argument('--threshold', type=float, default=0.2, help='increase considered a regression, 0.2 = 20%%')
+    args = parser.parse_args()
+
+    names = [i for i in cases(args.font) if args.filter in i]
+    results = run(names, args.font, args.min_time, args.min_runs)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            dump(results, f, indent=4)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = load(f)
+
+        print()
+        for name, result in results.items():
+            show(name, result, baseline.get(name))
+
+        if regressions := compare(results, baseline, args.threshold):
+            print(f'\n{len(regressions)} regressions')
+            for i in regressions:
+                print(f'    {i}')
+            sys.exit(1)
+        print('\nNo regressions')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,166 @@
+"""
+Import time of amsync
+
+Each statement runs in a new python with -X importtime, the slowest modules are shown
+and files created in the working directory by the import (like db.db) are reported
+
+    python benchmarks/import_time.py                          # all statements
+    python benchmarks/import_time.py --top 20                 # 20 slowest modules of each one
+    python benchmarks/import_time.py --save baseline.json     # save the results
+    python benchmarks/import_time.py --compare baseline.json  # compare with saved results
+
+With --compare, statements that got slower than --threshold are shown as regressions,
+as are imports that create files, and the exit code is 1
+"""
+
+from __future__ import annotations
+
+import sys
+from os import environ
+from typing import Any, Dict, List, Tuple
+from pathlib import Path
+from argparse import ArgumentParser
+from subprocess import run
+from statistics import median
+from tempfile import TemporaryDirectory
+
+from ujson import dump, load
+
+ROOT = Path(__file__).absolute().parent.parent
+
+STATEMENTS = [
+    'import amsync',
+    'from amsync import Bot, Msg',
+    'from amsync import MakeImage',
+    'from amsync import DB',
+    'from amsync import Archive',
+]
+
+# Dependencies that should only be imported when used
+HEAVY = ['PIL', 'peewee', 'aiohttp', 'colorama', 'pybase64', 'numpy', 'dotenv', 'filetype']
+
+
+def _importtime(statement: str) -> Tuple[List[Tuple[str, int, int]], List[str]]:
+    """
+    Returns (module, depth, cumulative us) of each module imported by statement,
+    and the files created in the working directory
+    """
+
+    # A clean folder as working directory, to see the files created by the import
+    with TemporaryDirectory() as cwd:
+        res = run(
+            [sys.executable, '-X', 'importtime', '-c', statement],
+            cwd            = cwd,
+            env            = {**environ, 'PYTHONPATH': str(ROOT)},
+            capture_output = True,
+            text           = True
+        )
+        created = [i.name for i in Path(cwd).iterdir()]
+
+    if res.returncode:
+        raise RuntimeError(res.stderr)
+
+    modules = []
+    for line in res.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        # Each level of nesting adds 2 spaces to the name
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        modules.append((name.strip(), depth, int(cumulative)))
+    return modules, created
+
+def measure(
+    statement: str,
+    runs:      int,
+    startup:   set[str]
+) -> Dict[str, Any]:
+    """
+    #### startup
+    Modules imported by python itself before the statement, they are ignored
+    """
+
+    totals = []
+    for _ in range(runs):
+        modules, created = _importtime(statement)
+        modules = [i for i in modules if i[0] not in startup]
+        # The time of the statement is the sum of the modules it imported directly
+        totals.append(sum(cumulative for _, depth, cumulative in modules if depth == 0))
+
+    return {
+        'median':  median(totals) / 1e6,
+        'heavy':   [i for i in HEAVY if any(name == i for name, _, _ in modules)],
+        'created': created,
+        'modules': sorted(((name, cumulative) for name, _, cumulative in modules), key=lambda i: -i[1])
+    }
+
+def show(
+    statement: str,
+    result:    Dict[str, Any],
+    top:       int,
+    old:       Dict[str, Any] | None = None
+) -> None:
+    line = f"{statement:<32} {result['median'] * 1000:8.1f} ms"
+    if old:
+        line += f" ({(result['median'] / old['median'] - 1) * 100:+6.1f}%)"
+    if result['heavy']:
+        line += f"  imports {', '.join(result['heavy'])}"
+    if result['created']:
+        line += f"  CREATES {', '.join(result['created'])}"
+    print(line)
+
+    for name, cumulative in result['modules'][:top]:
+        print(f'    {name:<40} {cumulative / 1000:8.1f} ms')
+
+def compare(
+    results:   Dict[str, Dict[str, Any]],
+    baseline:  Dict[str, Dict[str, Any]],
+    threshold: float
+) -> list[str]:
+    regressions = []
+    for statement, result in results.items():
+        if result['created']:
+            regressions.append(f"{statement}: creates {', '.join(result['created'])}")
+
+        old = baseline.get(statement)
+        # Differences of a few milliseconds are noise
+        if old and result['median'] > old['median'] * (1 + threshold) and result['median'] - old['median'] > 0.005:
+            regressions.append(f"{statement}: {old['median'] * 1000:.1f} ms -> {result['median'] * 1000:.1f} ms")
+    return regressions
+
+def main() -> None:
+    parser = ArgumentParser(description='Import time of amsync')
+    parser.add_argument('statements', nargs='*', default=STATEMENTS, help='statements measured, by default the most common imports')
+    parser.add_argument('--runs', type=int, default=5, help='runs of each statement, the median is used')
+    parser.add_argument('--top', type=int, default=0, help='show the slowest modules of each statement')
+    parser.add_argument('--save', help='save the results in this .json')
+    parser.add_argument('--compare', help='compare the results with this .json')
+    parser.add_argument('--threshold', type=float, default=0.2, help='increase considered a regression, 0.2 = 20%%')
+    args = parser.parse_args()
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = load(f)
+
+    startup = {name for name, _, _ in _importtime('pass')[0]}
+    results = {}
+    for statement in args.statements:
+        results[statement] = measure(statement, args.runs, startup)
+        show(statement, results[statement], args.top, baseline.get(statement))
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            dump(results, f, indent=4)
+
+    if args.compare:
+        if regressions := compare(results, baseline, args.threshold):
+            print(f'\n{len(regressions)} regressions')
+            for i in regressions:
+                print(f'    {i}')
+            sys.exit(1)
+        print('\nNo regressions')
+
+
+if __name__ == '__main__':
+    main()
@@ -5,7 +5,7 @@ from setuptools import setup, find_packages
 with open('README.md', 'r') as stream:
     long_description = stream.read()
 
-with open(f'amsync/__init__.py') as f:
+with open(f'amsync/version.py') as f:
     cont = f.read()
     prod_version = search(r'p[0-9]+.[0-9]+.[0-9]+', cont).group()[1:]
     test_version = search(r't[0-9]+.[0-9]+.[0-9]+', cont).group()[1:]